@@ -1,15 +1,24 @@
-import importlib
+import csv
+import io
+import json
 import time
+import zlib
 from collections import defaultdict
 from datetime import datetime
 
 import redis.exceptions
-from flask import request, jsonify, Blueprint
+from flask import request, jsonify, Blueprint, Response, stream_with_context
 from prometheus_client import Counter, Gauge
 
 import auth
+import dictionaries
+import events
+import ingest
+import ingest_buffer
 import reloader
-from database import db_cursor
+import stats
+from constants import STATS_BUCKET
+from database import db_cursor, server_cursor
 from models import FlagStatus
 
 api = Blueprint('api', __name__, url_prefix='/api')
@@ -40,55 +49,58 @@ def get_config():
 def post_flags():
     flags = request.json
     cur_time = round(time.time())
-    config = reloader.get_config()
+    snapshot = reloader.get_snapshot()
 
-    if config.get('SYSTEM_VALIDATOR'):
-        validator_module = importlib.import_module('validators.' + config['SYSTEM_VALIDATOR'])
-        flags = validator_module.validate_flags(flags, config)
-
-    rows = [
-        {
-            'flag': flag['flag'],
-            'sploit': flag['sploit'],
-            'team': flag['team'],
-            'time': cur_time,
-            'status': FlagStatus.QUEUED.name,
-        }
-        for flag in flags
-    ]
-
-    with db_cursor() as (conn, curs):
-        curs.executemany(
-            """
-            INSERT INTO flags (flag, sploit, team, time, status)
-            VALUES (%(flag)s, %(sploit)s, %(team)s, %(time)s, %(status)s)
-            ON CONFLICT DO NOTHING
-            """,
-            rows,
-        )
-        conn.commit()
+    if snapshot.config.get('SYSTEM_VALIDATOR'):
+        if snapshot.validator is None:
+            raise ImportError(f'validator {snapshot.config["SYSTEM_VALIDATOR"]} is not available')
+        flags = snapshot.validator.validate_flags(flags, snapshot.config)
+
+    flags = list(flags)
+
+    if snapshot.config.get('INGEST_MODE', 'direct') == 'redis':
+        result = ingest_buffer.enqueue(flags, cur_time, snapshot.config['FLAG_LIFETIME'])
+    else:
+        with db_cursor() as (conn, curs):
+            result = ingest.insert_flags(curs, flags, cur_time)
+            if result.inserted:
+                ingest.notify_queued(curs, snapshot.config)
+            conn.commit()
+        events.publish_queued(result.new_flags, cur_time)
 
     for flag in flags:
         FLAGS_RECEIVED.labels(sploit=flag['sploit'], team=flag['team']).inc()
 
-    return ''
+    return jsonify({
+        'received': result.received,
+        'inserted': result.inserted,
+        'duplicates': result.duplicates,
+    })
 
 
-@api.route('/filter_flags', methods=['GET'])
-@auth.auth_required
-def get_filtered_flags():
-    filters = request.args
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 
+def parse_flag_filters(curs, filters):
     conditions = []
-    for column in ['sploit', 'status', 'team']:
+    # Names that have never been stored give no rows, as `= NULL` never matches.
+    for column, dictionary in [('sploit', dictionaries.sploits), ('team', dictionaries.teams)]:
         value = filters.get(column)
         if value:
-            conditions.append((f'{column} = %s', value))
+            conditions.append((f'{column}_id = %s', dictionary.find_id(curs, value)))
 
+    status = filters.get('status')
+    if status:
+        if status not in FlagStatus.__members__:
+            raise ValueError('Invalid status')
+        conditions.append(('status = %s', FlagStatus[status].value))
+
+    # Substring search is served by the trigram indexes on LOWER(column).
     for column in ['flag', 'checksystem_response']:
         value = filters.get(column)
         if value:
-            conditions.append((f'POSITION(%s in LOWER({column})) > 0', value.lower()))
+            conditions.append((f'LOWER({column}) LIKE %s', f'%{escape_like(value.lower())}%'))
 
     for column in ['since', 'until']:
         value = filters.get(column, '').strip()
@@ -97,53 +109,214 @@ def get_filtered_flags():
             sign = '>=' if column == 'since' else '<='
             conditions.append((f'time {sign} %s', timestamp))
 
-    page = int(filters.get('page', 1))
-    if page < 1:
-        raise ValueError('Invalid page')
+    return conditions
+
+
+def build_where(conditions):
+    if not conditions:
+        return '', []
+
+    chunks, values = list(zip(*conditions))
+    return 'WHERE ' + ' AND '.join(chunks), list(values)
+
+
+def encode_cursor(flag):
+    return f'{flag["time"]}:{flag["flag"]}'
+
+
+def decode_cursor(cursor):
+    timestamp, _, flag = cursor.partition(':')
+    if not flag:
+        raise ValueError('Invalid cursor')
+    return int(timestamp), flag
+
+
+def estimate_count(curs, conditions_sql, conditions_args):
+    # Planner estimate, it's based on table statistics and doesn't touch the rows.
+    curs.execute('EXPLAIN (FORMAT JSON) SELECT 1 FROM all_flags ' + conditions_sql, conditions_args)
+    plan = curs.fetchone()['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+@api.route('/filter_flags', methods=['GET'])
+@auth.auth_required
+def get_filtered_flags():
+    """
+    Supports two pagination modes:
+    - `cursor`: keyset pagination on (time, flag), pass `next_cursor` from
+      the previous response (an empty value requests the first page);
+    - `page`: offset pagination, kept for compatibility.
+
+    `count` selects how `total` is computed: `exact` (default), `estimate`
+    (planner statistics) or `none`.
+    """
+    filters = request.args
 
     page_size = int(filters.get('page_size', 30))
     if page_size < 1 or page_size > 100:
         raise ValueError('Invalid page size')
 
-    if conditions:
-        chunks, values = list(zip(*conditions))
-        conditions_sql = 'WHERE ' + ' AND '.join(chunks)
-        conditions_args = list(values)
-    else:
-        conditions_sql = ''
-        conditions_args = []
-
-    sql = 'SELECT * FROM flags ' + conditions_sql + ' ORDER BY time DESC LIMIT %s OFFSET %s'
-    args = conditions_args + [page_size, page_size * (page - 1)]
+    count_mode = filters.get('count', 'exact')
+    if count_mode not in ('exact', 'estimate', 'none'):
+        raise ValueError('Invalid count mode')
 
-    count_sql = 'SELECT COUNT(*) as cnt FROM flags ' + conditions_sql
-    count_args = conditions_args
+    keyset = 'cursor' in filters
+    if keyset:
+        page = None
+    else:
+        page = int(filters.get('page', 1))
+        if page < 1:
+            raise ValueError('Invalid page')
 
     with db_cursor(True) as (_, curs):
+        # Sploit and team names are resolved to ids through the dictionaries cache.
+        conditions_sql, conditions_args = build_where(parse_flag_filters(curs, filters))
+
+        if keyset:
+            sql, args = conditions_sql, list(conditions_args)
+            if filters['cursor']:
+                sql += (' AND ' if sql else 'WHERE ') + '(time, flag) < (%s, %s)'
+                args += decode_cursor(filters['cursor'])
+            # Fetch one extra row to find out whether there is a next page.
+            sql = 'SELECT * FROM all_flags ' + sql + ' ORDER BY time DESC, flag DESC LIMIT %s'
+            args.append(page_size + 1)
+        else:
+            sql = 'SELECT * FROM all_flags ' + conditions_sql + ' ORDER BY time DESC, flag DESC LIMIT %s OFFSET %s'
+            args = conditions_args + [page_size, page_size * (page - 1)]
+
         curs.execute(sql, args)
-        flags = curs.fetchall()
-        curs.execute(count_sql, count_args)
-        total_count = curs.fetchone()['cnt']
+        flags = dictionaries.decode_rows(curs, curs.fetchall())
+
+        if count_mode == 'exact':
+            curs.execute('SELECT COUNT(*) as cnt FROM all_flags ' + conditions_sql, conditions_args)
+            total_count = curs.fetchone()['cnt']
+        elif count_mode == 'estimate':
+            total_count = estimate_count(curs, conditions_sql, conditions_args)
+        else:
+            total_count = None
+
+    next_cursor = None
+    if keyset and len(flags) > page_size:
+        flags = flags[:page_size]
+        next_cursor = encode_cursor(flags[-1])
 
     response = {
-        'flags': list(map(dict, flags)),
+        'flags': flags,
         'page_size': page_size,
         'page': page,
+        'next_cursor': next_cursor,
         'total': total_count,
     }
 
     return jsonify(response)
 
 
+EXPORT_COLUMNS = ['flag', 'sploit', 'team', 'time', 'status', 'checksystem_response']
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Rows fetched from the server cursor and encoded at once.
+EXPORT_CHUNK = 2000
+
+
+def encode_export_chunk(rows, export_format):
+    if export_format == 'ndjson':
+        return ''.join(json.dumps({key: row[key] for key in EXPORT_COLUMNS}) + '\n' for row in rows)
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_COLUMNS, extrasaction='ignore', lineterminator='\n')
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def generate_export(conditions_sql, conditions_args, export_format, compress):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+    def encode(text):
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    if export_format == 'csv':
+        yield encode(','.join(EXPORT_COLUMNS) + '\n')
+
+    # The named cursor keeps the result on the server, so memory use doesn't depend on its size.
+    # The regular cursor resolves the names of the chunks through the dictionaries.
+    with db_cursor(True) as (conn, curs), server_cursor(conn, 'export_flags', EXPORT_CHUNK) as rows_curs:
+        rows_curs.execute(
+            'SELECT * FROM all_flags ' + conditions_sql + ' ORDER BY time DESC, flag DESC',
+            conditions_args,
+        )
+        while True:
+            rows = rows_curs.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            chunk = encode(encode_export_chunk(dictionaries.decode_rows(curs, rows), export_format))
+            if chunk:
+                yield chunk
+
+    if compressor:
+        yield compressor.flush()
+
+
+@api.route('/export_flags', methods=['GET'])
+@auth.auth_required
+def export_flags():
+    """
+    Streams all flags matching the /api/filter_flags filters, newest first.
+    `format` is `ndjson` (default) or `csv`, `gzip=1` compresses the stream.
+    """
+    filters = request.args
+
+    export_format = filters.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Invalid format')
+    compress = filters.get('gzip', '') in ('1', 'true')
+
+    # Invalid filters are reported before the response starts.
+    with db_cursor(True) as (_, curs):
+        conditions_sql, conditions_args = build_where(parse_flag_filters(curs, filters))
+
+    filename = f'flags.{export_format}' + ('.gz' if compress else '')
+    response = Response(
+        stream_with_context(generate_export(conditions_sql, conditions_args, export_format, compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[export_format],
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    # Let the reverse proxy pass the chunks through as they come.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api.route('/events', methods=['GET'])
+@auth.auth_required
+def stream_events():
+    """
+    Server-Sent Events feed of the new flags and the verdicts, as `flags` events
+    with a JSON list of flags in the /api/filter_flags format. Can be narrowed down
+    with the `sploit`, `team` and `status` filters.
+    """
+    filters = {key: request.args[key] for key in events.FILTER_KEYS if request.args.get(key)}
+    if 'status' in filters and filters['status'] not in FlagStatus.__members__:
+        raise ValueError('Invalid status')
+
+    response = Response(stream_with_context(events.subscribe(filters)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api.route('/filter_config', methods=['GET'])
 @auth.auth_required
 def get_filter_config():
-    distinct_values = {}
     with db_cursor(True) as (_, curs):
-        for column in ['sploit', 'status', 'team']:
-            curs.execute(f'SELECT DISTINCT {column} FROM flags ORDER BY {column}')
-            rows = curs.fetchall()
-            distinct_values[column] = [item[column] for item in rows]
+        distinct_values = {
+            'sploit': dictionaries.sploits.get_all(curs),
+            'status': sorted(FlagStatus.__members__),
+            'team': dictionaries.teams.get_all(curs),
+        }
 
     config = reloader.get_config()
 
@@ -160,6 +333,43 @@ def get_filter_config():
     return jsonify(response)
 
 
+@api.route('/stats', methods=['GET'])
+@auth.auth_required
+def get_stats():
+    """
+    Flag counts by sploit, team and status from the flag_stats rollup.
+    Flags are counted in the time bucket they were received in. `since` and
+    `until` are unix timestamps (the last hour by default), `step` groups
+    the buckets and must be a multiple of the bucket width.
+    """
+    filters = request.args
+
+    now = round(time.time())
+    since = int(filters.get('since', now - 60 * 60))
+    until = int(filters.get('until', now))
+
+    step = int(filters.get('step', STATS_BUCKET))
+    if step < STATS_BUCKET or step % STATS_BUCKET != 0:
+        raise ValueError('Invalid step')
+
+    with db_cursor(True) as (_, curs):
+        rows = stats.get_stats(
+            curs,
+            since=since,
+            until=until,
+            step=step,
+            sploit=filters.get('sploit'),
+            team=filters.get('team'),
+        )
+
+    response = {
+        'step': step,
+        'stats': rows,
+    }
+
+    return jsonify(response)
+
+
 @api.route('/teams', methods=['GET'])
 @auth.auth_required
 def get_teams():
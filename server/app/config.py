@@ -33,6 +33,38 @@ CONFIG = {
     'SUBMIT_PERIOD': 2,
     'FLAG_LIFETIME': 5 * 60,
 
+    # How the flags submitted every SUBMIT_PERIOD are split between (sploit, team) groups:
+    # 'fair' splits each tick's limit evenly, 'drr' is a weighted deficit round robin
+    # that carries the groups' shares over between ticks.
+    'SUBMIT_SCHEDULER': 'drr',
+    # DRR: relative weights of the sploits, 1 by default.
+    'SPLOIT_WEIGHTS': {},
+    # DRR: multiply the weights by the sploits' acceptance ratio over the last 10 minutes.
+    'SCHEDULER_ACCEPTANCE_WEIGHTS': False,
+
+    # The order of flags within each (sploit, team) group: 'deadline' submits
+    # the flags closest to FLAG_LIFETIME first, 'random' picks them at random.
+    'SUBMIT_ORDER': 'deadline',
+
+    # Adapt the number of flags submitted every SUBMIT_PERIOD to the checksystem:
+    # starting from SUBMIT_FLAG_LIMIT, grow it by SUBMIT_FLAG_LIMIT_STEP while flags
+    # are accepted and halve it on rate limit responses, within the given bounds.
+    'SUBMIT_ADAPTIVE': False,
+    'SUBMIT_FLAG_LIMIT_STEP': 10,
+    'SUBMIT_FLAG_LIMIT_MIN': 10,
+    'SUBMIT_FLAG_LIMIT_MAX': 1000,
+
+    # 'direct' writes the flags from /api/post_flags to the database in the request,
+    # 'redis' appends them to a Redis stream and returns at once, the stream is
+    # flushed to the database in batches by a background task. The buffer is flushed
+    # in both modes, so switching back to 'direct' doesn't lose the buffered flags.
+    'INGEST_MODE': 'direct',
+
+    # 'beat' submits the flags from a celery task every SUBMIT_PERIOD, 'daemon' leaves it
+    # to the submitter service (submitter.py), which is woken up as soon as flags arrive
+    # and submits up to SUBMIT_FLAG_LIMIT flags per SUBMIT_PERIOD on its own.
+    'SUBMIT_MODE': 'beat',
+
     # VOLGA: Don't make more than INFO_FLAG_LIMIT requests to get flag info,
     # usually should be more than SUBMIT_FLAG_LIMIT
     # 'INFO_FLAG_LIMIT': 10,
@@ -5,7 +5,30 @@ BASE_DIR = Path(__file__).resolve().absolute().parent
 RESOURCES_DIR = BASE_DIR / 'resources'
 
 CONFIG_PATH = BASE_DIR / 'config.py'
+CONFIG_POLL_INTERVAL = float(os.getenv('CONFIG_POLL_INTERVAL', 1))
 SCHEMA_PATH = RESOURCES_DIR / 'schema.sql'
 
 REDIS_STORAGE_URL = os.getenv('REDIS_URL', 'redis://redis:6379/1')
 POSTGRES_DSN = os.getenv('POSTGRES_DSN', 'host=postgres port=5432 dbname=farm')
+# Maximum number of connections per process. When all of them are in use,
+# db_cursor waits up to POSTGRES_POOL_TIMEOUT seconds for one to be returned.
+POSTGRES_POOL_SIZE = int(os.getenv('POSTGRES_POOL_SIZE', 20))
+POSTGRES_POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', 30))
+# The hot queries are prepared once per connection, see statements.py.
+# Has to be disabled behind a pgbouncer in transaction pooling mode.
+POSTGRES_PREPARED_STATEMENTS = os.getenv('POSTGRES_PREPARED_STATEMENTS', '1') not in ('0', 'false', 'no')
+
+# Width of the flag_stats time buckets in seconds. Changing it for a database
+# that already has statistics mixes buckets of different sizes.
+STATS_BUCKET = int(os.getenv('STATS_BUCKET', 60))
+
+# Width of the flags table partitions in seconds, see partitions.py. Like STATS_BUCKET,
+# it shouldn't be changed for an existing database: new partitions would overlap the old ones.
+FLAGS_PARTITION_INTERVAL = int(os.getenv('FLAGS_PARTITION_INTERVAL', 60 * 60))
+# Partitions older than this many seconds are detached from the flags table, 0 keeps them forever.
+FLAGS_RETENTION = int(os.getenv('FLAGS_RETENTION', 0))
+# If set, detached partitions are dumped there as gzipped CSV and dropped.
+FLAGS_ARCHIVE_DIR = os.getenv('FLAGS_ARCHIVE_DIR', '')
+
+# Maximum number of flags written to the database by one flush of the Redis ingest buffer.
+INGEST_FLUSH_BATCH = int(os.getenv('INGEST_FLUSH_BATCH', 20000))
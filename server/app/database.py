@@ -4,14 +4,115 @@ Module with SQLite helpers, see http://flask.pocoo.org/docs/0.12/patterns/sqlite
 
 import logging
 import threading
+import time
 from contextlib import contextmanager
 
-from psycopg2 import pool, extras
+import psycopg2
+from prometheus_client import Gauge, Histogram
+from psycopg2 import extensions, pool, extras
 
-from constants import SCHEMA_PATH, POSTGRES_DSN
+import partitions
+import stats
+from constants import POSTGRES_DSN, POSTGRES_POOL_SIZE, POSTGRES_POOL_TIMEOUT, SCHEMA_PATH
 
 logger = logging.getLogger(__name__)
 
+DB_POOL_IN_USE = Gauge(
+    'db_pool_connections_in_use',
+    'Number of database connections checked out of the pool',
+)
+
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds',
+    'Time spent waiting for a free database connection',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+
+DB_POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_seconds',
+    'Time to get a connection from the pool, including the wait and opening new connections',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Lets other greenlets run while psycopg2 waits for the server, see psycopg2.extensions.set_wait_callback."""
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f'Bad result from poll: {state}')
+
+
+def install_wait_callback():
+    """Makes the queries cooperative in the gevent workers of gunicorn.
+
+    Only the monkey-patched processes are affected, celery runs threads and keeps the blocking calls
+    (COPY, used to archive the partitions, isn't available with a wait callback).
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket'):
+        extensions.set_wait_callback(gevent_wait_callback)
+
+
+class Connection(extensions.connection):
+    """Remembers the statements prepared in its session, see statements.py."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """Waits for a free connection instead of raising PoolError as soon as maxconn are in use.
+
+    threading is monkey-patched in the gevent workers, so the waiting greenlets are queued
+    on the semaphore without blocking the others.
+
+    `minconn` connections are opened at once, more are opened on demand and kept idle
+    up to `maxconn`, with their prepared statements.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=None, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # The base pool closes the returned connections once minconn are idle,
+        # it's only used to open the first ones.
+        self.minconn = maxconn
+        self._semaphore = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+
+    def getconn(self, key=None):
+        started = time.monotonic()
+        if not self._semaphore.acquire(timeout=self._timeout):
+            raise pool.PoolError(f'no free connection in {self._timeout} seconds')
+        DB_POOL_WAIT.observe(time.monotonic() - started)
+
+        try:
+            conn = super().getconn(key)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        DB_POOL_IN_USE.inc()
+        DB_POOL_CHECKOUT.observe(time.monotonic() - started)
+        return conn
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            DB_POOL_IN_USE.dec()
+            self._semaphore.release()
+
 
 class DBPool:
     _lock = threading.RLock()
@@ -19,16 +120,22 @@ class DBPool:
 
     @staticmethod
     def create():
-        p = pool.ThreadedConnectionPool(
-            minconn=5,
-            maxconn=20,
+        install_wait_callback()
+        p = BlockingConnectionPool(
+            minconn=min(5, POSTGRES_POOL_SIZE),
+            maxconn=POSTGRES_POOL_SIZE,
+            timeout=POSTGRES_POOL_TIMEOUT,
             dsn=POSTGRES_DSN,
+            connection_factory=Connection,
         )
         conn = p.getconn()
         logger.info("Initializing db schema")
         try:
-            with conn.cursor() as curs:
+            with conn.cursor(cursor_factory=extras.RealDictCursor) as curs:
                 curs.execute(SCHEMA_PATH.read_text())
+                partitions.migrate_unpartitioned(curs)
+                partitions.ensure_partitions(curs, round(time.time()))
+                stats.backfill(curs)
                 conn.commit()
         finally:
             p.putconn(conn)
@@ -56,3 +163,13 @@ def db_cursor(dict_cursor: bool = True):
     finally:
         curs.close()
         db_pool.putconn(conn)
+
+
+def server_cursor(conn, name: str, itersize: int = 2000):
+    """A named cursor: the rows of its query stay on the server and are fetched in batches.
+
+    Has to be used inside a transaction of `conn`, e.g. from db_cursor.
+    """
+    curs = conn.cursor(name=name, cursor_factory=extras.RealDictCursor)
+    curs.itersize = itersize
+    return curs
@@ -0,0 +1,110 @@
+"""
+Dictionary encoding of the sploit and team names. The flags, the queue, the statistics
+and the scheduler state refer to the names by id. Ids never change once assigned,
+so both directions are cached in process.
+"""
+
+import threading
+from typing import Iterable, Optional
+
+import psycopg2
+from psycopg2 import sql
+
+from constants import POSTGRES_DSN
+from models import FlagStatus
+
+
+class Dictionary:
+    def __init__(self, table: str):
+        self.table = table
+        self.lock = threading.Lock()
+        self.ids: dict[str, int] = {}
+        self.names: dict[int, str] = {}
+
+    def _remember(self, rows):
+        with self.lock:
+            for row in rows:
+                self.ids[row['name']] = row['id']
+                self.names[row['id']] = row['name']
+
+    def _load(self, curs, column: str, values: list):
+        curs.execute(
+            sql.SQL('SELECT id, name FROM {} WHERE {} = ANY(%s)').format(sql.Identifier(self.table), sql.Identifier(column)),
+            (values,),
+        )
+        self._remember(curs.fetchall())
+
+    def _insert(self, names: list):
+        # A direct connection rather than one from the pool: the caller already holds a pooled
+        # connection, so waiting for a second one could exhaust the pool.
+        conn = psycopg2.connect(POSTGRES_DSN)
+        try:
+            with conn, conn.cursor() as curs:
+                curs.execute(
+                    sql.SQL('INSERT INTO {} (name) SELECT unnest(%s::text[]) ON CONFLICT DO NOTHING').format(
+                        sql.Identifier(self.table),
+                    ),
+                    (names,),
+                )
+        finally:
+            conn.close()
+
+    def get_ids(self, curs, names: Iterable[str]) -> dict[str, int]:
+        """Returns the ids of the names, adding the unknown ones.
+
+        New names are committed on a separate short-lived connection. The caller's transaction
+        is left alone, and a rollback of it can't leave dangling ids in the cache.
+        """
+        names = set(names)
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            self._load(curs, 'name', missing)
+            missing = [name for name in missing if name not in self.ids]
+        if missing:
+            self._insert(missing)
+            self._load(curs, 'name', missing)
+        return {name: self.ids[name] for name in names}
+
+    def find_id(self, curs, name: str) -> Optional[int]:
+        """Returns the id of a name or None if nothing has been stored with it yet."""
+        if name not in self.ids:
+            self._load(curs, 'name', [name])
+        return self.ids.get(name)
+
+    def get_names(self, curs, ids: Iterable[Optional[int]]) -> dict[int, str]:
+        ids = {item for item in ids if item is not None}
+        missing = [item for item in ids if item not in self.names]
+        if missing:
+            self._load(curs, 'id', missing)
+        return {item: self.names[item] for item in ids if item in self.names}
+
+    def get_all(self, curs) -> list[str]:
+        curs.execute(sql.SQL('SELECT id, name FROM {} ORDER BY name').format(sql.Identifier(self.table)))
+        rows = curs.fetchall()
+        self._remember(rows)
+        return [row['name'] for row in rows]
+
+
+sploits = Dictionary('sploits')
+teams = Dictionary('teams')
+
+
+def decode_rows(curs, rows: list) -> list[dict]:
+    """Replaces sploit_id, team_id and the status value of the rows with the names."""
+    sploit_names = sploits.get_names(curs, (row['sploit_id'] for row in rows))
+    team_names = teams.get_names(curs, (row['team_id'] for row in rows))
+
+    result = []
+    for row in rows:
+        item = {}
+        for key, value in row.items():
+            if key == 'sploit_id':
+                item['sploit'] = sploit_names.get(value)
+            elif key == 'team_id':
+                item['team'] = team_names.get(value)
+            elif key == 'status':
+                item['status'] = FlagStatus(value).name
+            else:
+                item[key] = value
+        result.append(item)
+    return result
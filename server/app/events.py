@@ -0,0 +1,70 @@
+"""
+Live feed of the flags: new flags and the final verdicts are published to a Redis channel
+after they are committed and streamed to the clients of /api/events as Server-Sent Events.
+The feed is best effort, a Redis failure never fails the ingest or the submit cycle.
+"""
+
+import json
+import logging
+
+import redis
+
+from constants import REDIS_STORAGE_URL
+from models import FlagStatus
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'farm:events'
+# Flags per published message, a message becomes one SSE event.
+PUBLISH_CHUNK = 1000
+# A comment is sent after this many seconds without events, it keeps the proxies
+# from closing the connection and detects the clients that have gone.
+KEEPALIVE_INTERVAL = 15
+
+FILTER_KEYS = ['sploit', 'team', 'status']
+
+client = redis.Redis.from_url(REDIS_STORAGE_URL, decode_responses=True)
+
+
+def publish(flags: list[dict]):
+    """Sends the flags (flag, sploit, team, time, status, checksystem_response) to the subscribers."""
+    try:
+        for i in range(0, len(flags), PUBLISH_CHUNK):
+            client.publish(CHANNEL, json.dumps(flags[i:i + PUBLISH_CHUNK]))
+    except redis.exceptions.RedisError as e:
+        logger.warning('Failed to publish %s flag events: %s', len(flags), e)
+
+
+def publish_queued(new_flags: list[dict], cur_time: int):
+    """Publishes the flags returned by ingest.insert_flags once they are committed."""
+    publish([
+        dict(item, time=cur_time, status=FlagStatus.QUEUED.name, checksystem_response=None)
+        for item in new_flags
+    ])
+
+
+def matches(flag: dict, filters: dict) -> bool:
+    return all(flag.get(key) == value for key, value in filters.items())
+
+
+def format_event(flags: list[dict]) -> str:
+    return f'event: flags\ndata: {json.dumps(flags)}\n\n'
+
+
+def subscribe(filters: dict):
+    """Yields the SSE stream of the flags matching the filters, until the client disconnects."""
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(CHANNEL)
+        # Sent right away, so that the client knows the subscription is active.
+        yield ': subscribed\n\n'
+        while True:
+            message = pubsub.get_message(timeout=KEEPALIVE_INTERVAL)
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+            flags = [item for item in json.loads(message['data']) if matches(item, filters)]
+            if flags:
+                yield format_event(flags)
+    finally:
+        pubsub.close()
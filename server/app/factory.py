@@ -47,5 +47,13 @@ def create_celery():
             'task': 'tasks.submit_flags_task',
             'schedule': period,
         },
+        'maintain_partitions': {
+            'task': 'tasks.maintain_partitions_task',
+            'schedule': 60,
+        },
+        'flush_ingest_buffer': {
+            'task': 'tasks.flush_ingest_buffer_task',
+            'schedule': 1,
+        },
     }
     return celery
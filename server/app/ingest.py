@@ -0,0 +1,90 @@
+import logging
+from typing import List
+
+import dictionaries
+import stats
+from models import FlagStatus, IngestResult
+from statements import PreparedStatement
+
+logger = logging.getLogger(__name__)
+
+# Listened to by the submit daemon, see submitter.py.
+QUEUED_CHANNEL = 'flags_queued'
+
+# The whole batch is sent as a handful of arrays and merged with a single
+# INSERT ... SELECT, so the cost of a request doesn't depend on the number
+# of round trips. Known flags (and duplicates inside the batch) are filtered
+# out by flags_seen, which covers both the queue and the partitioned history.
+# The flag_stats counters are updated in the same statement.
+INSERT_FLAGS = PreparedStatement('insert_flags', """
+WITH batch AS (
+    SELECT DISTINCT ON (flag) *
+    FROM unnest(%(flags)s::text[], %(sploit_ids)s::integer[], %(team_ids)s::integer[]) AS batch(flag, sploit_id, team_id)
+),
+seen AS (
+    INSERT INTO flags_seen (flag, time)
+    SELECT flag, %(time)s FROM batch
+    ON CONFLICT DO NOTHING
+    RETURNING flag
+),
+inserted AS (
+    INSERT INTO flags_queue (flag, sploit_id, team_id, time)
+    SELECT batch.flag, batch.sploit_id, batch.team_id, %(time)s
+    FROM batch JOIN seen USING (flag)
+    RETURNING flag, sploit_id, team_id
+),
+groups AS (
+    SELECT sploit_id, team_id, COUNT(*) AS cnt FROM inserted GROUP BY sploit_id, team_id
+),
+stats AS (
+    INSERT INTO flag_stats (bucket, sploit_id, team_id, status, count)
+    SELECT %(bucket)s, sploit_id, team_id, %(status)s, cnt FROM groups
+    -- Same lock order as stats.UPSERT, so that concurrent ingest and submit don't deadlock.
+    ORDER BY sploit_id, team_id
+    ON CONFLICT (bucket, sploit_id, team_id, status) DO UPDATE SET count = flag_stats.count + EXCLUDED.count
+)
+SELECT flag, sploit_id, team_id FROM inserted
+""", flags='text[]', sploit_ids='integer[]', team_ids='integer[]', time='integer', bucket='integer', status='smallint')
+
+
+def insert_flags(curs, flags: List[dict], cur_time: int) -> IngestResult:
+    """Insert a batch of flags, skipping the ones that are already known.
+
+    Expects a dict cursor, the caller is responsible for committing the transaction.
+    New sploit and team names are committed separately, see dictionaries.Dictionary.get_ids.
+    """
+    if not flags:
+        return IngestResult(received=0, inserted=0)
+
+    sploit_ids = dictionaries.sploits.get_ids(curs, (item['sploit'] for item in flags))
+    team_ids = dictionaries.teams.get_ids(curs, (item['team'] for item in flags))
+
+    INSERT_FLAGS.execute(
+        curs,
+        {
+            'time': cur_time,
+            'bucket': stats.get_bucket(cur_time),
+            'status': FlagStatus.QUEUED.value,
+            'flags': [item['flag'] for item in flags],
+            'sploit_ids': [sploit_ids[item['sploit']] for item in flags],
+            'team_ids': [team_ids[item['team']] for item in flags],
+        },
+    )
+    sploit_names = {value: key for key, value in sploit_ids.items()}
+    team_names = {value: key for key, value in team_ids.items()}
+    new_flags = [
+        {'flag': row['flag'], 'sploit': sploit_names[row['sploit_id']], 'team': team_names[row['team_id']]}
+        for row in curs.fetchall()
+    ]
+
+    logger.debug('Inserted %s/%s flags', len(new_flags), len(flags))
+    return IngestResult(received=len(flags), inserted=len(new_flags), new_flags=new_flags)
+
+
+def notify_queued(curs, config):
+    """Wakes the submit daemon up once the transaction is committed, if SUBMIT_MODE is 'daemon'.
+
+    NOTIFY serializes the commits of the notifying transactions, so it's not sent otherwise.
+    """
+    if config.get('SUBMIT_MODE', 'beat') == 'daemon':
+        curs.execute(f'NOTIFY {QUEUED_CHANNEL}')
@@ -0,0 +1,167 @@
+"""
+Redis-backed ingest buffer, used with INGEST_MODE = 'redis'. /api/post_flags appends
+the batches of new flags to a stream and returns, flush() drains the stream into the
+database in large batches.
+
+The recently seen flags are kept in Redis sets rotated every FLAG_LIFETIME, so most
+of the resent flags never reach the stream. The database still has the final say
+on duplicates, the flusher goes through ingest.insert_flags.
+"""
+
+import json
+import os
+import socket
+from collections import defaultdict
+from typing import Optional
+
+import redis
+from prometheus_client import Counter, Gauge
+
+import events
+import ingest
+import reloader
+from constants import INGEST_FLUSH_BATCH, REDIS_STORAGE_URL
+from database import db_cursor
+from models import IngestResult
+
+STREAM = 'farm:ingest'
+GROUP = 'flusher'
+SEEN_PREFIX = 'farm:ingest:seen:'
+
+# Stream entries (post_flags batches) read at once.
+READ_COUNT = 100
+# Entries read but not acknowledged for this long, e.g. because the flusher died, are taken over.
+CLAIM_IDLE_TIME = 60
+
+CONSUMER = f'{socket.gethostname()}-{os.getpid()}'
+
+# KEYS: stream, current seen set, previous seen set.
+# ARGV: time, seen set TTL, then (flag, sploit, team) triples.
+ENQUEUE_SCRIPT = """
+local accepted = {}
+for i = 3, #ARGV, 3 do
+    local flag = ARGV[i]
+    if redis.call('SISMEMBER', KEYS[3], flag) == 0 and redis.call('SADD', KEYS[2], flag) == 1 then
+        table.insert(accepted, {flag, ARGV[i + 1], ARGV[i + 2]})
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if #accepted > 0 then
+    redis.call('XADD', KEYS[1], '*', 'time', ARGV[1], 'flags', cjson.encode(accepted))
+end
+return #accepted
+"""
+
+FLAGS_FLUSHED = Counter(
+    'flags_flushed',
+    'Number of flags moved from the Redis ingest buffer to the database',
+)
+
+INGEST_BUFFER_LENGTH = Gauge(
+    'ingest_buffer_length',
+    'Number of post_flags batches waiting in the Redis ingest buffer',
+)
+
+client = redis.Redis.from_url(REDIS_STORAGE_URL, decode_responses=True)
+enqueue_script = client.register_script(ENQUEUE_SCRIPT)
+
+
+def enqueue(flags, cur_time: int, lifetime: int) -> IngestResult:
+    """Buffers the flags that haven't been seen recently, in a single round trip.
+
+    `inserted` of the result counts the buffered flags, they reach the database with the next flush.
+    """
+    if not flags:
+        return IngestResult(received=0, inserted=0)
+
+    window = max(int(lifetime), 1)
+    bucket = cur_time // window
+    args = [cur_time, 2 * window]
+    for item in flags:
+        args += [item['flag'], item['sploit'], item['team']]
+
+    inserted = enqueue_script(keys=[STREAM, f'{SEEN_PREFIX}{bucket}', f'{SEEN_PREFIX}{bucket - 1}'], args=args)
+    return IngestResult(received=len(flags), inserted=inserted)
+
+
+def oldest_time() -> Optional[int]:
+    """Returns the time the oldest buffered flags were received at, None if the buffer is empty."""
+    entries = client.xrange(STREAM, count=1)
+    return int(entries[0][1]['time']) if entries and entries[0][1] else None
+
+
+def ensure_group():
+    try:
+        client.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def read_entries() -> list:
+    """Takes over the stale entries of the other flushers first, then reads the new ones."""
+    pending = client.xpending_range(STREAM, GROUP, min='-', max='+', count=READ_COUNT)
+    stale = [item['message_id'] for item in pending if item['time_since_delivered'] >= CLAIM_IDLE_TIME * 1000]
+    if stale:
+        entries = client.xclaim(STREAM, GROUP, CONSUMER, CLAIM_IDLE_TIME * 1000, stale)
+        if entries:
+            return entries
+
+    response = client.xreadgroup(GROUP, CONSUMER, {STREAM: '>'}, count=READ_COUNT)
+    return response[0][1] if response else []
+
+
+def flush() -> int:
+    """Moves the buffered flags to the database, returns the number of flags read from the stream."""
+    # The entries stay in the stream until flushed (read but not acknowledged ones included),
+    # so an empty stream means there is nothing to do. XLEN is O(1), unlike the group commands.
+    if not client.xlen(STREAM):
+        INGEST_BUFFER_LENGTH.set(0)
+        return 0
+
+    ensure_group()
+
+    total = 0
+    while True:
+        entries = []
+        batch = 0
+        while batch < INGEST_FLUSH_BATCH:
+            chunk = read_entries()
+            if not chunk:
+                break
+            entries += chunk
+            batch += sum(len(json.loads(fields['flags'])) for _, fields in chunk if fields)
+        if not entries:
+            break
+
+        flags_by_time = defaultdict(list)
+        for _, fields in entries:
+            # Entries deleted while pending are claimed without the fields.
+            if not fields:
+                continue
+            for flag, sploit, team in json.loads(fields['flags']):
+                flags_by_time[int(fields['time'])].append({'flag': flag, 'sploit': sploit, 'team': team})
+
+        # Flags keep the time they were received at, it's the start of their FLAG_LIFETIME.
+        with db_cursor(True) as (conn, curs):
+            inserted = [
+                (cur_time, ingest.insert_flags(curs, flags, cur_time).new_flags)
+                for cur_time, flags in sorted(flags_by_time.items())
+            ]
+            if any(new_flags for _, new_flags in inserted):
+                ingest.notify_queued(curs, reloader.get_config())
+            conn.commit()
+        for cur_time, new_flags in inserted:
+            events.publish_queued(new_flags, cur_time)
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        client.xack(STREAM, GROUP, *entry_ids)
+        client.xdel(STREAM, *entry_ids)
+
+        FLAGS_FLUSHED.inc(batch)
+        total += batch
+        if batch < INGEST_FLUSH_BATCH:
+            break
+
+    INGEST_BUFFER_LENGTH.set(client.xlen(STREAM))
+    return total
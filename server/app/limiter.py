@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import deque
+from types import ModuleType
+from typing import Iterable, List, Mapping, Optional
+
+from prometheus_client import Counter, Gauge
+
+from models import FlagStatus, SubmitResult
+
+logger = logging.getLogger(__name__)
+
+# Multiplicative decrease on a rate limit verdict.
+DECREASE_FACTOR = 0.5
+
+SUBMIT_FLAG_LIMIT = Gauge(
+    'submit_flag_limit',
+    'Number of flags submitted per SUBMIT_PERIOD',
+)
+
+SUBMIT_RATE = Gauge(
+    'submit_rate',
+    'Flags that got a final verdict per second, over the last SUBMIT_PERIOD',
+)
+
+FLAGS_RATE_LIMITED = Counter(
+    'flags_rate_limited',
+    'Number of flags returned to the queue because of checksystem rate limiting',
+)
+
+
+def get_rate_limit_responses(protocol: Optional[ModuleType]) -> list[str]:
+    """Substrings of the queued verdicts that mean the checksystem throttles us.
+
+    Protocols declare them in RATE_LIMIT_RESPONSES, the limiter halves the budget when they show up.
+    They are case-sensitive and should be specific to throttling: a generic error must not shrink the budget.
+    """
+    return getattr(protocol, 'RATE_LIMIT_RESPONSES', [])
+
+
+def is_rate_limited(result: SubmitResult, rate_limit_responses: Iterable[str]) -> bool:
+    if result.status != FlagStatus.QUEUED:
+        return False
+    response = result.checksystem_response or ''
+    return any(s in response for s in rate_limit_responses)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD controller for the number of flags submitted per tick.
+
+    With SUBMIT_ADAPTIVE enabled, the limit starts at SUBMIT_FLAG_LIMIT, grows by
+    SUBMIT_FLAG_LIMIT_STEP after each tick that submitted the whole budget and got final verdicts
+    and is halved when the checksystem returns the protocol's rate limit verdicts.
+    It stays within [SUBMIT_FLAG_LIMIT_MIN, SUBMIT_FLAG_LIMIT_MAX].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit: Optional[float] = None
+        # (time, number of final verdicts) of the recent ticks, for SUBMIT_RATE.
+        self.verdicts: deque[tuple[float, int]] = deque()
+
+    @staticmethod
+    def _bounds(config: Mapping) -> tuple[int, int]:
+        static_limit = config['SUBMIT_FLAG_LIMIT']
+        return (
+            config.get('SUBMIT_FLAG_LIMIT_MIN', max(1, static_limit // 10)),
+            config.get('SUBMIT_FLAG_LIMIT_MAX', static_limit * 10),
+        )
+
+    def get_budget(self, config: Mapping) -> int:
+        if not config.get('SUBMIT_ADAPTIVE'):
+            budget = config['SUBMIT_FLAG_LIMIT']
+        else:
+            low, high = self._bounds(config)
+            with self.lock:
+                if self.limit is None:
+                    self.limit = config['SUBMIT_FLAG_LIMIT']
+                self.limit = min(max(self.limit, low), high)
+                budget = int(self.limit)
+
+        SUBMIT_FLAG_LIMIT.set(budget)
+        return budget
+
+    def _record_verdicts(self, config: Mapping, count: int):
+        period = config['SUBMIT_PERIOD']
+        now = time.monotonic()
+        with self.lock:
+            self.verdicts.append((now, count))
+            while self.verdicts[0][0] <= now - period:
+                self.verdicts.popleft()
+            total = sum(count for _, count in self.verdicts)
+        SUBMIT_RATE.set(total / period)
+
+    def update(self, config: Mapping, budget: int, results: List[SubmitResult],
+               protocol: Optional[ModuleType] = None):
+        rate_limit_responses = get_rate_limit_responses(protocol)
+        rate_limited = sum(is_rate_limited(item, rate_limit_responses) for item in results)
+        FLAGS_RATE_LIMITED.inc(rate_limited)
+        final = sum(item.status != FlagStatus.QUEUED for item in results)
+        self._record_verdicts(config, final)
+
+        if not config.get('SUBMIT_ADAPTIVE'):
+            return
+
+        low, high = self._bounds(config)
+        with self.lock:
+            if self.limit is None:
+                return
+
+            if rate_limited:
+                self.limit = max(low, self.limit * DECREASE_FACTOR)
+                logger.info('Checksystem rate limited %s flags, submit limit is now %d', rate_limited, self.limit)
+            elif len(results) >= budget and final > 0:
+                # Grow only when the budget was the bottleneck. A tick without final verdicts
+                # doesn't count, e.g. a checksystem that is down makes every flag queued.
+                self.limit = min(high, self.limit + config.get('SUBMIT_FLAG_LIMIT_STEP', max(1, budget // 10)))
+
+
+limiter = AdaptiveLimiter()
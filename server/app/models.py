@@ -1,5 +1,5 @@
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class FlagStatus(Enum):
@@ -24,3 +24,24 @@ class SubmitResult:
     flag: str
     status: FlagStatus
     checksystem_response: str
+
+
+@dataclass
+class IngestResult:
+    received: int
+    inserted: int
+    # The inserted flags as dicts with flag, sploit and team, for the live feed.
+    new_flags: list = field(default_factory=list)
+
+    @property
+    def duplicates(self) -> int:
+        return self.received - self.inserted
+
+
+@dataclass
+class SubmitCycle:
+    queued: int = 0
+    skipped: int = 0
+    submitted: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+    results: list = field(default_factory=list)
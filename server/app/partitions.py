@@ -0,0 +1,213 @@
+"""
+Maintenance of the time partitions of the flags table: creation ahead of time,
+the migration of pre-partitioning databases and the retention policy.
+"""
+
+import gzip
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+from psycopg2 import sql
+
+from constants import FLAGS_ARCHIVE_DIR, FLAGS_PARTITION_INTERVAL, FLAGS_RETENTION
+from models import FlagStatus
+
+logger = logging.getLogger(__name__)
+
+# Number of partitions created in advance. They are cheap, but every partition
+# adds to the planning time of the queries that can't be pruned by time.
+PARTITIONS_AHEAD = 6
+
+BOUND_RE = re.compile(r'FROM \((-?\d+)\) TO \((-?\d+)\)')
+
+LEGACY_FROM = """
+FROM flags_unpartitioned AS legacy
+LEFT JOIN sploits ON sploits.name = legacy.sploit
+LEFT JOIN teams ON teams.name = legacy.team
+"""
+
+ARCHIVE_SQL = sql.SQL("""
+COPY (
+    SELECT archived.flag, sploits.name AS sploit, teams.name AS team, archived.time,
+        ({statuses}::text[])[archived.status + 1] AS status, archived.checksystem_response
+    FROM {partition} AS archived
+    LEFT JOIN sploits ON sploits.id = archived.sploit_id
+    LEFT JOIN teams ON teams.id = archived.team_id
+) TO STDOUT WITH (FORMAT csv, HEADER)
+""")
+
+
+def create_partitions(curs, since: int, until: int):
+    curs.execute('SELECT create_flags_partitions(%s, %s, %s)', (since, until, FLAGS_PARTITION_INTERVAL))
+
+
+def ensure_partitions(curs, now: int):
+    """Creates the partitions for the previous interval up to PARTITIONS_AHEAD intervals ahead."""
+    create_partitions(curs, now - FLAGS_PARTITION_INTERVAL, now + (PARTITIONS_AHEAD + 1) * FLAGS_PARTITION_INTERVAL)
+
+
+def get_partitions(curs) -> list[tuple[str, int, int, bool]]:
+    """Returns (name, start, end, detach pending) of the attached partitions, oldest first."""
+    curs.execute(
+        """
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound,
+            pg_inherits.inhdetachpending AS pending
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'flags'::regclass
+        """
+    )
+    partitions = []
+    for row in curs.fetchall():
+        match = BOUND_RE.search(row['bound'])
+        if match is None:
+            logger.warning('Unexpected bound of partition %s: %s', row['name'], row['bound'])
+            continue
+        partitions.append((row['name'], int(match.group(1)), int(match.group(2)), row['pending']))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def get_detached(curs) -> list[str]:
+    """Returns the names of the partitions that have been detached from flags, but not dropped."""
+    curs.execute(
+        r"""
+        SELECT relname AS name FROM pg_class
+        WHERE relkind = 'r' AND NOT relispartition AND relnamespace = current_schema()::regnamespace
+            AND relname ~ '^flags_-?\d+$'
+        ORDER BY relname
+        """
+    )
+    return [row['name'] for row in curs.fetchall()]
+
+
+def detach_partition(conn, name: str, pending: bool):
+    """
+    Detaches a partition with DETACH CONCURRENTLY: it doesn't take an ACCESS EXCLUSIVE lock on flags,
+    so the submit and listing queries don't queue behind it while it waits for a long export.
+    It can't run in a transaction block. A detach interrupted half-way leaves the partition pending,
+    it's completed with FINALIZE.
+    """
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as curs:
+            curs.execute(sql.SQL('ALTER TABLE flags DETACH PARTITION {} {}').format(
+                sql.Identifier(name),
+                sql.SQL('FINALIZE' if pending else 'CONCURRENTLY'),
+            ))
+    finally:
+        conn.autocommit = False
+
+
+def migrate_unpartitioned(curs):
+    """Moves the rows of a flags table created before the partitioning, see schema.sql."""
+    curs.execute("SELECT to_regclass('flags_unpartitioned') IS NOT NULL AS found")
+    if not curs.fetchone()['found']:
+        return
+
+    curs.execute('SELECT MIN(time) AS since, MAX(time) AS until FROM flags_unpartitioned')
+    bounds = curs.fetchone()
+    if bounds['since'] is not None:
+        logger.info('Moving flags to the partitions')
+        create_partitions(curs, bounds['since'], bounds['until'] + 1)
+        # The legacy table stores the names and statuses as text.
+        curs.execute(
+            """
+            INSERT INTO sploits (name) SELECT DISTINCT sploit FROM flags_unpartitioned
+            WHERE sploit IS NOT NULL ON CONFLICT DO NOTHING
+            """
+        )
+        curs.execute(
+            """
+            INSERT INTO teams (name) SELECT DISTINCT team FROM flags_unpartitioned
+            WHERE team IS NOT NULL ON CONFLICT DO NOTHING
+            """
+        )
+        curs.execute(
+            f"""
+            INSERT INTO flags (flag, sploit_id, team_id, time, status, checksystem_response)
+            SELECT legacy.flag, sploits.id, teams.id, legacy.time, flag_status_value(legacy.status),
+                legacy.checksystem_response
+            {LEGACY_FROM}
+            WHERE legacy.time IS NOT NULL AND legacy.status IS DISTINCT FROM 'QUEUED'
+            """
+        )
+        curs.execute(
+            f"""
+            INSERT INTO flags_queue (flag, sploit_id, team_id, time, checksystem_response)
+            SELECT legacy.flag, sploits.id, teams.id, legacy.time, legacy.checksystem_response
+            {LEGACY_FROM}
+            WHERE legacy.time IS NOT NULL AND legacy.status = 'QUEUED'
+            """
+        )
+        curs.execute(
+            """
+            INSERT INTO flags_seen (flag, time)
+            SELECT flag, time FROM flags_unpartitioned WHERE time IS NOT NULL
+            ON CONFLICT DO NOTHING
+            """
+        )
+    curs.execute('DROP TABLE flags_unpartitioned')
+
+
+def archive_partition(curs, name: str):
+    """Dumps a detached partition to FLAGS_ARCHIVE_DIR as gzipped CSV, with the names instead of the ids."""
+    archive_dir = Path(FLAGS_ARCHIVE_DIR)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
+    path = archive_dir / f'{name}.csv.gz'
+    tmp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp_path, 'wb') as file:
+        curs.copy_expert(ARCHIVE_SQL.format(
+            partition=sql.Identifier(name),
+            statuses=sql.Literal([status.name for status in sorted(FlagStatus, key=lambda item: item.value)]),
+        ), file)
+    # The archive appears only when complete, the table is dropped only after that.
+    os.replace(tmp_path, path)
+
+
+def apply_retention(conn, curs, now: int, flag_lifetime: int, oldest_buffered: Optional[int] = None) -> list[str]:
+    """
+    Detaches the partitions that ended more than FLAGS_RETENTION seconds ago.
+    They are kept as standalone tables, or archived and dropped if FLAGS_ARCHIVE_DIR is set.
+    Returns the names of the detached partitions.
+
+    The partitions that may still receive flags are kept: the ones after the start
+    of FLAG_LIFETIME, the oldest queued flag and the oldest flag in the ingest buffer
+    (`oldest_buffered`), as there is no partition for older rows.
+    """
+    if not FLAGS_RETENTION:
+        return []
+
+    curs.execute('SELECT MIN(time) AS oldest FROM flags_queue')
+    oldest_queued = curs.fetchone()['oldest']
+    horizon = min(
+        item for item in (now - FLAGS_RETENTION, now - flag_lifetime, oldest_queued, oldest_buffered)
+        if item is not None
+    )
+    partitions = get_partitions(curs)
+    expired = [(name, pending) for name, _, end, pending in partitions if end <= horizon]
+
+    for name, pending in expired:
+        detach_partition(conn, name, pending)
+        logger.info('Detached partition %s', name)
+
+    if FLAGS_ARCHIVE_DIR:
+        # Also picks up the partitions left detached by the runs that failed to archive them.
+        for name in get_detached(curs):
+            archive_partition(curs, name)
+            curs.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(name)))
+            conn.commit()
+            logger.info('Archived partition %s', name)
+
+    expired_names = {name for name, _ in expired}
+    remaining = [start for name, start, _, _ in partitions if name not in expired_names]
+    if remaining:
+        # A flag resent after its partition was detached is accepted again.
+        curs.execute('DELETE FROM flags_seen WHERE time < %s', (remaining[0],))
+        conn.commit()
+
+    return [name for name, _ in expired]
@@ -0,0 +1,73 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, Mapping, Optional
+
+from prometheus_client import Counter
+
+from models import FlagStatus
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_RESPONSES = Counter(
+    'checksystem_unknown_responses',
+    'Number of checksystem responses that did not match any known verdict',
+)
+
+# The most recent distinct unknown responses, only the first occurrence of each is logged.
+MAX_UNKNOWN_RESPONSES = 1000
+_unknown_lock = threading.Lock()
+_unknown_responses: OrderedDict[str, None] = OrderedDict()
+
+
+def report_unknown(response: str):
+    UNKNOWN_RESPONSES.inc()
+    with _unknown_lock:
+        new = response not in _unknown_responses
+        _unknown_responses[response] = None
+        _unknown_responses.move_to_end(response)
+        if len(_unknown_responses) > MAX_UNKNOWN_RESPONSES:
+            _unknown_responses.popitem(last=False)
+    if new:
+        logger.warning('Unknown checksystem response (flag will be resent): %s', response)
+
+
+class ResponseClassifier:
+    """
+    Maps checksystem responses to flag statuses by substrings. The first status
+    (in the order of `responses`) with a substring found in the response wins,
+    unknown responses leave the flag queued.
+
+    The whole table is compiled into one regex: a branch per status, each branch is
+    a lookahead for any of the status' substrings. Branches are tried in order, so
+    the priority of statuses is kept. Verdicts are memoized, as checksystems
+    answer with a few distinct strings.
+    """
+
+    def __init__(self, responses: Mapping[FlagStatus, Iterable[str]], ignore_case: bool = True,
+                 cache_size: int = 4096):
+        self.statuses = list(responses)
+
+        branches = []
+        for i, substrings in enumerate(responses.values()):
+            # Longer alternatives first, so that the regex engine doesn't stop at a prefix.
+            alternatives = '|'.join(map(re.escape, sorted(substrings, key=len, reverse=True)))
+            branches.append(f'(?=.*?(?:{alternatives}))(?P<s{i}>)')
+        self.regex = re.compile('|'.join(branches), re.DOTALL | (re.IGNORECASE if ignore_case else 0))
+
+        self._match = lru_cache(maxsize=cache_size)(self._match_uncached)
+
+    def _match_uncached(self, response: str) -> Optional[FlagStatus]:
+        match = self.regex.match(response)
+        if match is None:
+            return None
+        return self.statuses[int(match.lastgroup[1:])]
+
+    def classify(self, response: str) -> FlagStatus:
+        status = self._match(response)
+        if status is None:
+            report_unknown(response)
+            return FlagStatus.QUEUED
+        return status
@@ -1,7 +1,8 @@
-import socket
 import logging
 
 from models import FlagStatus, SubmitResult
+from protocols import tcp
+from protocols.classifier import ResponseClassifier
 
 logger = logging.getLogger(__name__)
 
@@ -30,56 +31,23 @@ RESPONSES = {
     ),
 }
 
-READ_TIMEOUT = 5
-APPEND_TIMEOUT = 0.05
-BUFSIZE = 4096
+RATE_LIMIT_RESPONSES = ['try again later']
 
+CLASSIFIER = ResponseClassifier(RESPONSES)
 
-def recvall(sock):
-    sock.settimeout(READ_TIMEOUT)
-    chunks = [sock.recv(BUFSIZE)]
+GREETING = b'Please enter flags'
 
-    sock.settimeout(APPEND_TIMEOUT)
-    while True:
-        try:
-            chunk = sock.recv(BUFSIZE)
-            if not chunk:
-                break
 
-            chunks.append(chunk)
-        except socket.timeout:
-            break
-
-    sock.settimeout(READ_TIMEOUT)
-    return b''.join(chunks)
+def parse_line(line, submitted):
+    # Responses look like "[<flag>] <verdict>".
+    if line.startswith('[') and '] ' in line:
+        flag, response = line[1:].split('] ', 1)
+        return flag, response
+    return None, line
 
 
 def submit_flags(flags, config):
-    sock = socket.create_connection((config['SYSTEM_HOST'], config['SYSTEM_PORT']),
-                                    READ_TIMEOUT)
-    greeting = recvall(sock)
-    if b'Please enter flags' not in greeting:
-        raise Exception('Checksystem does not greet us: {}'.format(greeting))
-
-    unknown_responses = set()
-    for item in flags:
-        sock.sendall(item.flag.encode() + b'\n')
-        response = recvall(sock).decode().strip()
-        if response:
-            response = response.splitlines()[0]
-        response = response.replace('[{}] '.format(item.flag), '')
-
-        response_lower = response.lower()
-        for status, substrings in RESPONSES.items():
-            if any(s in response_lower for s in substrings):
-                found_status = status
-                break
-        else:
-            found_status = FlagStatus.QUEUED
-            if response not in unknown_responses:
-                unknown_responses.add(response)
-                logger.warning('Unknown checksystem response (flag will be resent): %s', response)
-
-        yield SubmitResult(item.flag, found_status, response)
-
-    sock.close()
+    window = config.get('SUBMIT_WINDOW', tcp.DEFAULT_WINDOW)
+    with tcp.connection(config, GREETING) as session:
+        for item, response in tcp.submit_pipelined(session, flags, window, parse_line):
+            yield SubmitResult(item.flag, CLASSIFIER.classify(response), response)
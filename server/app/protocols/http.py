@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+T = TypeVar('T')
+
+TIMEOUT = 5
+
+# Maximum number of concurrent requests to the checksystem,
+# can be overridden with SUBMIT_CONCURRENCY in the config.
+DEFAULT_CONCURRENCY = 10
+
+
+class Client:
+    """
+    A keep-alive connection pool to the checksystem shared by the submit ticks,
+    with a bounded number of requests in flight.
+    """
+
+    def __init__(self, concurrency: int):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='checksystem-http')
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', TIMEOUT)
+        return self.session.request(method, url, **kwargs)
+
+    def map(self, fn: Callable[..., T], items: Iterable) -> list[Union[T, Exception]]:
+        """Runs fn for every item concurrently, exceptions are returned in place of the results."""
+
+        def call(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                return e
+
+        return list(self.executor.map(call, items))
+
+
+_clients_lock = threading.Lock()
+_clients: dict[int, Client] = {}
+
+
+def get_client(config) -> Client:
+    concurrency = config.get('SUBMIT_CONCURRENCY', DEFAULT_CONCURRENCY)
+    with _clients_lock:
+        if concurrency not in _clients:
+            _clients[concurrency] = Client(concurrency)
+        return _clients[concurrency]
@@ -1,7 +1,8 @@
-import requests
 import logging
 
 from models import FlagStatus, SubmitResult
+from protocols import http
+from protocols.classifier import ResponseClassifier
 
 logger = logging.getLogger(__name__)
 
@@ -19,29 +20,18 @@ RESPONSES = {
 # The latter situation happens if a checker puts the flag to the service before putting it
 # to the checksystem database. We should resent the flag later in this case.
 
+RATE_LIMIT_RESPONSES = ['try again later', 'Too Many Requests']
 
-TIMEOUT = 5
+CLASSIFIER = ResponseClassifier(RESPONSES)
 
 
 def submit_flags(flags, config):
-    r = requests.put(config['SYSTEM_URL'],
-                     headers={'X-Team-Token': config['SYSTEM_TOKEN']},
-                     json=[item.flag for item in flags], timeout=TIMEOUT)
+    r = http.get_client(config).request('PUT', config['SYSTEM_URL'],
+                                        headers={'X-Team-Token': config['SYSTEM_TOKEN']},
+                                        json=[item.flag for item in flags])
 
-    unknown_responses = set()
     for item in r.json():
         response = item['msg'].strip()
         response = response.replace('[{}] '.format(item['flag']), '')
 
-        response_lower = response.lower()
-        for status, substrings in RESPONSES.items():
-            if any(s in response_lower for s in substrings):
-                found_status = status
-                break
-        else:
-            found_status = FlagStatus.QUEUED
-            if response not in unknown_responses:
-                unknown_responses.add(response)
-                logger.warning('Unknown checksystem response (flag will be resent): %s', response)
-
-        yield SubmitResult(item['flag'], found_status, response)
+        yield SubmitResult(item['flag'], CLASSIFIER.classify(response), response)
@@ -0,0 +1,211 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Container, Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+READ_TIMEOUT = 5
+APPEND_TIMEOUT = 0.05
+BUFSIZE = 4096
+
+# Number of flags sent without waiting for their responses, see submit_pipelined.
+# Can be overridden with SUBMIT_WINDOW in the config.
+DEFAULT_WINDOW = 50
+
+# Idle connections older than this are reopened, checksystems tend to drop them silently.
+MAX_IDLE_TIME = 60
+
+CONNECTIONS_OPENED = Counter(
+    'checksystem_connections_opened',
+    'Number of connections opened to the checksystem',
+)
+
+
+def recvall(sock):
+    sock.settimeout(READ_TIMEOUT)
+    chunks = [sock.recv(BUFSIZE)]
+
+    sock.settimeout(APPEND_TIMEOUT)
+    while True:
+        try:
+            chunk = sock.recv(BUFSIZE)
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+        except socket.timeout:
+            break
+
+    sock.settimeout(READ_TIMEOUT)
+    return b''.join(chunks)
+
+
+class Session:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = b''
+        self.broken = False
+        self.last_used = time.monotonic()
+
+    def readline(self) -> bytes:
+        """Returns the next line without the line break, raises on EOF and timeout."""
+        while True:
+            pos = self.buffer.find(b'\n')
+            if pos != -1:
+                line, self.buffer = self.buffer[:pos], self.buffer[pos + 1:]
+                return line.rstrip(b'\r')
+
+            chunk = self.sock.recv(BUFSIZE)
+            if not chunk:
+                raise ConnectionError('Checksystem closed the connection')
+            self.buffer += chunk
+
+    def is_healthy(self) -> bool:
+        if self.broken or self.buffer or time.monotonic() - self.last_used > MAX_IDLE_TIME:
+            return False
+
+        self.sock.setblocking(False)
+        try:
+            data = self.sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            # Nothing to read: the connection is open and in sync.
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.settimeout(READ_TIMEOUT)
+        # Either EOF or unsolicited data (e.g. late responses from the previous
+        # tick), which would be mixed up with the next responses.
+        logger.debug('Dropping checksystem connection, pending data: %s', data)
+        return False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionManager:
+    """
+    Keeps greeted checksystem connections open between submit ticks.
+    A connection is used by one thread at a time and is discarded
+    if the submission using it fails or marks it as broken.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle: dict[tuple[str, int, bytes], list[Session]] = {}
+
+    def _acquire(self, key) -> Optional[Session]:
+        while True:
+            with self.lock:
+                sessions = self.idle.get(key)
+                if not sessions:
+                    return None
+                session = sessions.pop()
+
+            if session.is_healthy():
+                return session
+            session.close()
+
+    def _release(self, key, session: Session):
+        session.last_used = time.monotonic()
+        with self.lock:
+            self.idle.setdefault(key, []).append(session)
+
+    @staticmethod
+    def _connect(host: str, port: int, greeting: bytes) -> Session:
+        sock = socket.create_connection((host, port), READ_TIMEOUT)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        CONNECTIONS_OPENED.inc()
+
+        response = recvall(sock)
+        if greeting not in response:
+            sock.close()
+            raise Exception('Checksystem does not greet us: {}'.format(response))
+
+        logger.info('Connected to the checksystem at %s:%s', host, port)
+        return Session(sock)
+
+    @contextmanager
+    def connection(self, host: str, port: int, greeting: bytes):
+        key = (host, int(port), greeting)
+        session = self._acquire(key) or self._connect(*key)
+        try:
+            yield session
+        except BaseException:
+            session.close()
+            raise
+
+        if session.broken:
+            session.close()
+        else:
+            self._release(key, session)
+
+
+manager = ConnectionManager()
+
+
+def connection(config, greeting: bytes):
+    """Checks out a greeted connection to SYSTEM_HOST:SYSTEM_PORT."""
+    return manager.connection(config['SYSTEM_HOST'], config['SYSTEM_PORT'], greeting)
+
+
+def submit_pipelined(session: Session, flags, window: int,
+                     parse_line: Callable[[str, Container[str]], tuple[Optional[str], str]]):
+    """
+    Sends flags keeping up to `window` of them in flight and yields (flag, response)
+    pairs as the lines arrive. `parse_line` extracts the echoed flag and the verdict
+    from a line, it gets the submitted flags to tell an echo from other text.
+    A line without a flag is matched to the oldest unanswered one. A line naming
+    a flag that is not unanswered (already answered or never sent) is dropped.
+
+    If the checksystem stops responding, the unanswered flags are not yielded
+    (they stay queued) and the session is marked as broken.
+    """
+    pending = {item.flag: item for item in flags}
+    submitted = frozenset(pending)
+    # Flags are sent in this order, so the oldest pending flag is always in flight.
+    order = deque(pending.values())
+    to_send = deque(order)
+    in_flight = 0
+
+    while pending:
+        if to_send and in_flight <= window // 2:
+            batch = [to_send.popleft() for _ in range(min(window - in_flight, len(to_send)))]
+            session.sock.sendall(b''.join(item.flag.encode() + b'\n' for item in batch))
+            in_flight += len(batch)
+
+        try:
+            line = session.readline().decode(errors='replace').strip()
+        except OSError as e:
+            logger.warning('Checksystem stopped responding, %s flags left unanswered: %s', len(pending), e)
+            session.broken = True
+            return
+        if not line:
+            continue
+
+        flag_text, response = parse_line(line, submitted)
+        if flag_text is not None:
+            item = pending.pop(flag_text, None)
+            if item is None:
+                logger.warning('Checksystem response for a flag not in flight: %s', line)
+                continue
+        else:
+            while order and order[0].flag not in pending:
+                order.popleft()
+            if in_flight == 0:
+                logger.warning('Unexpected checksystem response: %s', line)
+                continue
+            item = pending.pop(order.popleft().flag)
+            response = line
+
+        in_flight -= 1
+        yield item, response
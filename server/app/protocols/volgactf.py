@@ -1,6 +1,7 @@
 import datetime
 from enum import Enum
 from itertools import chain
+from typing import Union
 
 import dateutil.parser
 import pytz
@@ -8,6 +9,7 @@ import requests
 import logging
 
 from models import FlagStatus, SubmitResult
+from protocols import http
 
 logger = logging.getLogger(__name__)
 
@@ -58,10 +60,13 @@ RESPONSES = {
     }
 }
 
+RATE_LIMIT_RESPONSES = ['ratelimit exceeded', 'flag info ratelimit', 'Too Many Requests']
+
 
 class API:
-    def __init__(self, host: str, timezone: str, version='v1'):
-        self.api_base = f'https://{host}/api/flag/{version}'
+    def __init__(self, client: http.Client, host: str, timezone: str, version='v1', scheme='https'):
+        self.client = client
+        self.api_base = f'{scheme}://{host}/api/flag/{version}'
         self.timezone = pytz.timezone(timezone)
 
     def flag_is_fresh(self, info, until_seconds=2):
@@ -70,7 +75,10 @@ class API:
         until = self.timezone.localize(until)
         return expiry >= until
 
-    def parse_flag_info_response(self, flag: str, response: requests.Response):
+    def parse_flag_info_response(self, flag: str, response: Union[requests.Response, Exception]):
+        if isinstance(response, Exception):
+            return False, SubmitResult(flag, FlagStatus.QUEUED, f'flag getinfo failed: {response}')
+
         if response.status_code == 200:
             info = response.json()
             if self.flag_is_fresh(info):
@@ -88,11 +96,14 @@ class API:
         return False, SubmitResult(flag, FlagStatus.QUEUED, f'error response from flag getinfo: {respcode}')
 
     def info_flags(self, *flags: str):
-        responses = list(map(lambda flag: requests.get(f'{self.api_base}/info/{flag}'), flags))
+        responses = self.client.map(lambda flag: self.client.request('GET', f'{self.api_base}/info/{flag}'), flags)
         return dict(zip(flags, map(self.parse_flag_info_response, flags, responses)))
 
     @staticmethod
-    def parse_flag_submit_response(flag: str, response: requests.Response):
+    def parse_flag_submit_response(flag: str, response: Union[requests.Response, Exception]):
+        if isinstance(response, Exception):
+            return SubmitResult(flag, FlagStatus.QUEUED, f'flag submission failed: {response}')
+
         try:
             result_code = ChecksystemResult[response.text]
         except:  # noqa
@@ -106,14 +117,18 @@ class API:
 
     def submit_flags(self, *flags: str):
         h = {'Content-Type': 'text/plain'}
-        responses = [requests.post(f'{self.api_base}/submit', data=flag, headers=h) for flag in flags]
+        responses = self.client.map(
+            lambda flag: self.client.request('POST', f'{self.api_base}/submit', data=flag, headers=h),
+            flags,
+        )
         return map(self.parse_flag_submit_response, flags, responses)
 
 
 def submit_flags(flags, config):
     flags = list(map(lambda flag: flag.flag, flags))
 
-    api = API(host=config['SYSTEM_HOST'], timezone=config['TIMEZONE'])
+    api = API(http.get_client(config), host=config['SYSTEM_HOST'], timezone=config['TIMEZONE'],
+              scheme=config.get('SYSTEM_SCHEME', 'https'))
     info_rate = config['INFO_FLAG_LIMIT']
     submit_rate = config['SUBMIT_FLAG_LIMIT']
 
@@ -9,6 +9,8 @@ RESPONSES = {
                           Result.ERROR_FLAG_SUBMITTED, Result.ERROR_FLAG_NOT_FOUND],
 }
 
+RATE_LIMIT_RESPONSES = ['ERROR_RATELIMIT']
+
 
 def submit_flags(flags, config):
     h = Helper(config['SYSTEM_HOST'])
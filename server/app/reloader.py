@@ -1,48 +1,96 @@
 import importlib
 import logging
 import threading
-from typing import Optional
+import time
+from dataclasses import dataclass
+from types import MappingProxyType, ModuleType
+from typing import Mapping, Optional
 
 import config
-from constants import CONFIG_PATH
+from constants import CONFIG_PATH, CONFIG_POLL_INTERVAL
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    version: int
+    config: Mapping
+    protocol: Optional[ModuleType]
+    validator: Optional[ModuleType]
+
+
+def import_optional(package: str, name: Optional[str]) -> Optional[ModuleType]:
+    if not name:
+        return None
+
+    try:
+        return importlib.import_module(f'{package}.{name}')
+    except Exception as e:
+        logger.error('Failed to import %s.%s: %s', package, name, e)
+        return None
+
+
+def build_snapshot(cfg: dict, version: int) -> ConfigSnapshot:
+    return ConfigSnapshot(
+        version=version,
+        config=MappingProxyType(cfg),
+        protocol=import_optional('protocols', cfg.get('SYSTEM_PROTOCOL')),
+        validator=import_optional('validators', cfg.get('SYSTEM_VALIDATOR')),
+    )
+
+
 class ConfigReloader:
+    """
+    Keeps an immutable snapshot of the config. The snapshot is replaced by
+    a background watcher when config.py changes, so readers never lock.
+    """
+
     def __init__(self):
-        self.lock = threading.Lock()
-        self.config = config.CONFIG
-        self.updated_at = None
+        self.updated_at = CONFIG_PATH.stat().st_mtime_ns
+        self.snapshot = build_snapshot(config.CONFIG, version=1)
+
+        self.watcher = threading.Thread(target=self._watch, name='config-watcher', daemon=True)
+        self.watcher.start()
 
-    def get_config(self):
-        self._check_config()
-        return self.config
+    def _watch(self):
+        while True:
+            time.sleep(CONFIG_POLL_INTERVAL)
+            try:
+                self._check_config()
+            except Exception as e:
+                logger.error('Failed to check config: %s', e)
 
     def _check_config(self):
         cur_mtime = CONFIG_PATH.stat().st_mtime_ns
-        if cur_mtime != self.updated_at:
-            with self.lock:
-                if cur_mtime != self.updated_at:
-                    try:
-                        importlib.reload(config)
-                        self.config = config.CONFIG
-                        logger.info('New config loaded')
-                    except Exception as e:
-                        logger.error('Failed to reload config: %s', e)
+        if cur_mtime == self.updated_at:
+            return
 
-                    self.updated_at = cur_mtime
+        self.updated_at = cur_mtime
+        try:
+            importlib.reload(config)
+        except Exception as e:
+            logger.error('Failed to reload config: %s', e)
+            return
+
+        self.snapshot = build_snapshot(config.CONFIG, version=self.snapshot.version + 1)
+        logger.info('New config loaded, version %s', self.snapshot.version)
 
 
 _reloader_lock = threading.Lock()
 _reloader: Optional[ConfigReloader] = None
 
 
-def get_config():
+def get_snapshot() -> ConfigSnapshot:
     global _reloader
-    with _reloader_lock:
-        if _reloader is None:
-            logger.info('Creating a new reloader')
-            _reloader = ConfigReloader()
-            logger.info('Created reloader instance')
-    return _reloader.get_config()
+    if _reloader is None:
+        with _reloader_lock:
+            if _reloader is None:
+                logger.info('Creating a new reloader')
+                _reloader = ConfigReloader()
+                logger.info('Created reloader instance')
+    return _reloader.snapshot
+
+
+def get_config() -> Mapping:
+    return get_snapshot().config
@@ -1,13 +1,186 @@
+-- Workers bootstrap the schema concurrently on startup, the migrations below must not interleave.
+SELECT pg_advisory_xact_lock(hashtext('farm_schema'));
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Databases created before the partitioning have a plain flags table. It's renamed here and
+-- its rows are moved to the partitions by partitions.migrate_unpartitioned on startup.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('flags') AND relkind = 'r') THEN
+        ALTER TABLE flags RENAME TO flags_unpartitioned;
+        ALTER TABLE flags_unpartitioned RENAME CONSTRAINT flags_pkey TO flags_unpartitioned_pkey;
+        DROP INDEX IF EXISTS idx_flags_sploit, idx_flags_team, idx_flags_status_time, idx_flags_queued,
+            idx_flags_time, idx_flags_time_flag, idx_flags_flag_trgm, idx_flags_checksystem_response_trgm;
+    END IF;
+END
+$$;
+
+-- Sploit and team names are stored once, the other tables refer to them by id.
+-- The ids never change, so the processes cache them, see dictionaries.py.
+CREATE TABLE IF NOT EXISTS sploits (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS teams (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+-- Statuses are stored as the values of models.FlagStatus.
+CREATE OR REPLACE FUNCTION flag_status_value(status_name TEXT) RETURNS SMALLINT AS $$
+    SELECT (CASE status_name WHEN 'QUEUED' THEN 0 WHEN 'SKIPPED' THEN 1 WHEN 'ACCEPTED' THEN 2 WHEN 'REJECTED' THEN 3 END)::smallint
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Partitioned by the time the flags were received, so that old flags can be detached or archived
+-- without bloating the hot indexes. Partitions are created ahead of time, see partitions.py.
 CREATE TABLE IF NOT EXISTS flags (
+    flag TEXT,
+    sploit_id INTEGER,
+    team_id INTEGER,
+    time INTEGER NOT NULL,
+    status SMALLINT,
+    checksystem_response TEXT,
+    PRIMARY KEY (flag, time)
+) PARTITION BY RANGE (time);
+
+-- Flags waiting for a final verdict. The submit task works only with this small table,
+-- flags are moved to the history table (flags) once skipped, accepted or rejected.
+CREATE TABLE IF NOT EXISTS flags_queue (
     flag TEXT PRIMARY KEY,
-    sploit TEXT,
-    team TEXT,
-    time INTEGER,
-    status TEXT,
+    sploit_id INTEGER,
+    team_id INTEGER,
+    time INTEGER NOT NULL,
     checksystem_response TEXT
 );
 
-CREATE INDEX IF NOT EXISTS idx_flags_sploit ON flags(sploit);
-CREATE INDEX IF NOT EXISTS idx_flags_team ON flags(team);
+-- Number of flags per sploit, team and status, bucketed by the time the flags were received.
+-- Maintained incrementally by the ingest and submit paths, see stats.py.
+CREATE TABLE IF NOT EXISTS flag_stats (
+    bucket INTEGER,
+    sploit_id INTEGER,
+    team_id INTEGER,
+    status SMALLINT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, sploit_id, team_id, status)
+);
+
+-- Deficits of the weighted deficit round robin scheduler, see scheduler.py.
+CREATE TABLE IF NOT EXISTS scheduler_deficits (
+    sploit_id INTEGER,
+    team_id INTEGER,
+    deficit DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (sploit_id, team_id)
+);
+
+-- Databases created before the dictionaries store the names and statuses as text.
+-- Indexes and primary keys on the dropped columns go away with them and are recreated below,
+-- so does the all_flags view that reads them.
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['flags', 'flags_queue', 'flag_stats', 'scheduler_deficits'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = t AND column_name = 'sploit'
+        ) THEN
+            DROP VIEW IF EXISTS all_flags;
+            EXECUTE format('INSERT INTO sploits (name) SELECT DISTINCT sploit FROM %I WHERE sploit IS NOT NULL ON CONFLICT DO NOTHING', t);
+            EXECUTE format('INSERT INTO teams (name) SELECT DISTINCT team FROM %I WHERE team IS NOT NULL ON CONFLICT DO NOTHING', t);
+            EXECUTE format('ALTER TABLE %I ADD COLUMN sploit_id INTEGER, ADD COLUMN team_id INTEGER', t);
+            EXECUTE format(
+                'UPDATE %1$I SET sploit_id = sploits.id, team_id = teams.id FROM sploits, teams '
+                'WHERE sploits.name = %1$I.sploit AND teams.name = %1$I.team',
+                t
+            );
+            EXECUTE format('ALTER TABLE %I DROP COLUMN sploit, DROP COLUMN team', t);
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = t AND column_name = 'status' AND data_type = 'text'
+        ) THEN
+            DROP VIEW IF EXISTS all_flags;
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN status TYPE SMALLINT USING flag_status_value(status)', t);
+        END IF;
+    END LOOP;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'flag_stats'::regclass AND contype = 'p') THEN
+        ALTER TABLE flag_stats ADD PRIMARY KEY (bucket, sploit_id, team_id, status);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'scheduler_deficits'::regclass AND contype = 'p') THEN
+        ALTER TABLE scheduler_deficits ADD PRIMARY KEY (sploit_id, team_id);
+    END IF;
+END
+$$;
+
+-- Replaced by the dictionaries.
+DROP TABLE IF EXISTS flag_filter_values;
+
+CREATE INDEX IF NOT EXISTS idx_flags_sploit ON flags(sploit_id);
+CREATE INDEX IF NOT EXISTS idx_flags_team ON flags(team_id);
 CREATE INDEX IF NOT EXISTS idx_flags_status_time ON flags(status, time);
-CREATE INDEX IF NOT EXISTS idx_flags_time ON flags(time);
+-- Queued flags live in flags_queue now.
+DROP INDEX IF EXISTS idx_flags_queued;
+-- Serves both ORDER BY time DESC, flag DESC and the keyset pagination predicate.
+-- The partitions are scanned newest first, so the recent pages only touch the recent partitions.
+CREATE INDEX IF NOT EXISTS idx_flags_time_flag ON flags(time, flag);
+
+-- Substring search in /api/filter_flags.
+CREATE INDEX IF NOT EXISTS idx_flags_flag_trgm ON flags USING gin (LOWER(flag) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_flags_checksystem_response_trgm ON flags USING gin (LOWER(checksystem_response) gin_trgm_ops);
+
+-- Per-group queue sizes and the fair share selection of the submit task.
+CREATE INDEX IF NOT EXISTS idx_flags_queue_group ON flags_queue(sploit_id, team_id, time);
+CREATE INDEX IF NOT EXISTS idx_flags_queue_time_flag ON flags_queue(time, flag);
+
+-- Queued flags of the databases created before flags_queue.
+WITH queued AS (
+    DELETE FROM flags WHERE status = flag_status_value('QUEUED') RETURNING *
+)
+INSERT INTO flags_queue (flag, sploit_id, team_id, time, checksystem_response)
+SELECT flag, sploit_id, team_id, time, checksystem_response FROM queued
+ON CONFLICT DO NOTHING;
+
+-- Both queued and finished flags, for the web interface. Replacing the view takes an exclusive lock,
+-- which waits for the open export cursors and blocks all the readers behind it, so it's only created
+-- when missing or outdated. The version is kept in the comment, bump it when changing the definition.
+DO $$
+BEGIN
+    IF obj_description(to_regclass('all_flags'), 'pg_class') IS DISTINCT FROM 'all_flags v1' THEN
+        DROP VIEW IF EXISTS all_flags;
+        CREATE VIEW all_flags AS
+        SELECT flag, sploit_id, team_id, time, flag_status_value('QUEUED') AS status, checksystem_response FROM flags_queue
+        UNION ALL
+        SELECT flag, sploit_id, team_id, time, status, checksystem_response FROM flags;
+        COMMENT ON VIEW all_flags IS 'all_flags v1';
+    END IF;
+END
+$$;
+
+-- The primary key of a partitioned table has to include the partition key, so flags are
+-- deduplicated on ingest by this table. Rows older than the oldest partition are pruned.
+CREATE TABLE IF NOT EXISTS flags_seen (
+    flag TEXT PRIMARY KEY,
+    time INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_flags_seen_time ON flags_seen(time);
+
+-- Creates the missing `step` seconds wide partitions of flags covering [since, until).
+CREATE OR REPLACE FUNCTION create_flags_partitions(since INTEGER, until INTEGER, step INTEGER) RETURNS void AS $$
+DECLARE
+    start INTEGER := since - since % step;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('create_flags_partitions'));
+    WHILE start < until LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF flags FOR VALUES FROM (%s) TO (%s)',
+            'flags_' || start, start, start + step
+        );
+        start := start + step;
+    END LOOP;
+END
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,124 @@
+import logging
+import math
+import time
+from collections import defaultdict
+from typing import List, Mapping
+
+from models import FlagStatus
+from utils import get_fair_quotas
+
+logger = logging.getLogger(__name__)
+
+
+def get_weights(curs, groups: List[dict], config: Mapping) -> List[float]:
+    weights = config.get('SPLOIT_WEIGHTS', {})
+    result = []
+    for item in groups:
+        weight = float(weights.get(item['sploit'], 1))
+        if not weight >= 0:
+            logger.warning('Invalid weight of sploit %s: %s, using 0', item['sploit'], weight)
+            weight = 0.0
+        result.append(weight)
+
+    if config.get('SCHEDULER_ACCEPTANCE_WEIGHTS'):
+        window = config.get('SCHEDULER_ACCEPTANCE_WINDOW', 10 * 60)
+        curs.execute(
+            """
+            SELECT sploit_id, status, SUM(count) AS cnt FROM flag_stats
+            WHERE bucket >= %s AND status IN %s
+            GROUP BY sploit_id, status
+            """,
+            (round(time.time()) - window, (FlagStatus.ACCEPTED.value, FlagStatus.REJECTED.value)),
+        )
+        verdicts = defaultdict(lambda: defaultdict(int))
+        for row in curs.fetchall():
+            verdicts[row['sploit_id']][row['status']] = row['cnt']
+
+        for i, item in enumerate(groups):
+            counts = verdicts[item['sploit_id']]
+            accepted = counts[FlagStatus.ACCEPTED.value]
+            # Laplace smoothing, so new sploits start from 0.5 and never get a zero weight.
+            result[i] *= (accepted + 1) / (accepted + counts[FlagStatus.REJECTED.value] + 2)
+
+    return result
+
+
+def get_drr_quotas(sizes: List[int], weights: List[float], deficits: List[float], limit: int) -> List[int]:
+    """
+    Weighted deficit round robin over the groups. Every round each backlogged group
+    earns a share of the remaining places proportional to its weight and takes as many
+    whole places as its deficit allows. `deficits` are updated in place, groups that
+    have been drained lose their deficit. Groups with a zero weight get no places.
+    """
+    quotas = [0] * len(sizes)
+    backlogged = [i for i, size in enumerate(sizes) if size > 0 and weights[i] > 0]
+    places_left = limit
+
+    while places_left > 0 and backlogged:
+        total_weight = sum(weights[i] for i in backlogged)
+        if total_weight <= 0:
+            break
+        round_places = places_left
+        for i in backlogged:
+            deficits[i] += round_places * weights[i] / total_weight
+
+        progress = False
+        for i in backlogged:
+            take = min(math.floor(deficits[i]), sizes[i] - quotas[i], places_left)
+            if take > 0:
+                quotas[i] += take
+                deficits[i] -= take
+                places_left -= take
+                progress = True
+
+        if not progress:
+            # The shares are too small to make a whole place: give the places to the groups
+            # with the largest deficits, they pay it back in the next ticks.
+            for i in sorted(backlogged, key=deficits.__getitem__, reverse=True)[:places_left]:
+                quotas[i] += 1
+                deficits[i] -= 1
+                places_left -= 1
+
+        for i in backlogged:
+            if quotas[i] == sizes[i]:
+                deficits[i] = 0
+        backlogged = [i for i in backlogged if quotas[i] < sizes[i]]
+
+    return quotas
+
+
+def get_quotas(curs, groups: List[dict], limit: int, config: Mapping) -> List[int]:
+    """
+    Splits `limit` places between the queued (sploit, team) groups according to
+    SUBMIT_SCHEDULER. `groups` are rows with the sploit and team (both the ids
+    and the names), group size (cnt) and the time of the oldest flag.
+    """
+    sizes = [item['cnt'] for item in groups]
+    deadline = config.get('SUBMIT_ORDER') == 'deadline'
+
+    if config.get('SUBMIT_SCHEDULER', 'fair') != 'drr':
+        return get_fair_quotas(sizes, limit, [item['oldest'] for item in groups] if deadline else None)
+
+    # Deficits survive between ticks (and processes). The lock serializes concurrent ticks,
+    # it's held until the caller's transaction ends.
+    curs.execute('LOCK TABLE scheduler_deficits IN SHARE ROW EXCLUSIVE MODE')
+    curs.execute('SELECT sploit_id, team_id, deficit FROM scheduler_deficits')
+    saved = {(row['sploit_id'], row['team_id']): row['deficit'] for row in curs.fetchall()}
+
+    deficits = [saved.get((item['sploit_id'], item['team_id']), 0.0) for item in groups]
+    quotas = get_drr_quotas(sizes, get_weights(curs, groups, config), deficits, limit)
+
+    # Groups that are not in the queue anymore are forgotten, as drained ones.
+    curs.execute('DELETE FROM scheduler_deficits')
+    curs.execute(
+        """
+        INSERT INTO scheduler_deficits (sploit_id, team_id, deficit)
+        SELECT * FROM unnest(%s::integer[], %s::integer[], %s::double precision[])
+        """,
+        (
+            [item['sploit_id'] for item in groups],
+            [item['team_id'] for item in groups],
+            deficits,
+        ),
+    )
+    return quotas
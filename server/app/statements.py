@@ -0,0 +1,58 @@
+"""
+Server-side prepared statements for the queries that run on every request or submit cycle.
+A statement is prepared the first time it's executed on a pooled connection and reused after,
+so the server skips the parsing and, once it settles on a generic plan, the planning.
+"""
+
+import re
+
+from constants import POSTGRES_PREPARED_STATEMENTS
+
+PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+# Can be switched off at runtime, e.g. by the benchmarks.
+enabled = POSTGRES_PREPARED_STATEMENTS
+
+registry: dict[str, 'PreparedStatement'] = {}
+
+
+class PreparedStatement:
+    """A query with %(name)s placeholders and the SQL types of its parameters, in keyword order."""
+
+    def __init__(self, name: str, query: str, **types: str):
+        if name in registry:
+            raise ValueError(f'statement {name} is already registered')
+        registry[name] = self
+
+        self.name = name
+        self.query = query
+        positions = {param: i for i, param in enumerate(types, 1)}
+        unknown = set(PARAM_RE.findall(query)) - set(positions)
+        if unknown:
+            raise ValueError(f'statement {name} has parameters without a type: {", ".join(sorted(unknown))}')
+
+        body = PARAM_RE.sub(lambda match: f'${positions[match.group(1)]}', query).replace('%%', '%')
+        signature = f' ({", ".join(types.values())})' if types else ''
+        self.prepare_sql = f'PREPARE {name}{signature} AS {body}'
+        arguments = f' ({", ".join(f"%({param})s" for param in types)})' if types else ''
+        self.execute_sql = f'EXECUTE {name}{arguments}'
+
+    def prepare(self, curs) -> bool:
+        """Prepares the statement on the connection of the cursor unless it's done already.
+
+        Returns False for the connections that can't keep track of it (not from the pool).
+        """
+        prepared = getattr(curs.connection, 'prepared', None)
+        if prepared is None:
+            return False
+        if self.name not in prepared:
+            # Prepared statements belong to the session, they survive the rollback of the transaction.
+            curs.execute(self.prepare_sql)
+            prepared.add(self.name)
+        return True
+
+    def execute(self, curs, params: dict = None):
+        if enabled and self.prepare(curs):
+            curs.execute(self.execute_sql, params)
+        else:
+            curs.execute(self.query, params)
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import dictionaries
+from constants import STATS_BUCKET
+from statements import PreparedStatement
+
+UPSERT = PreparedStatement('upsert_flag_stats', """
+INSERT INTO flag_stats (bucket, sploit_id, team_id, status, count)
+SELECT * FROM unnest(%(buckets)s::integer[], %(sploit_ids)s::integer[], %(team_ids)s::integer[], %(statuses)s::smallint[], %(counts)s::integer[])
+    AS deltas(bucket, sploit_id, team_id, status, count)
+-- The rows are locked in the key order, the ingest statement takes them in the same order.
+ORDER BY bucket, sploit_id, team_id, status
+ON CONFLICT (bucket, sploit_id, team_id, status) DO UPDATE SET count = flag_stats.count + EXCLUDED.count
+""", buckets='integer[]', sploit_ids='integer[]', team_ids='integer[]', statuses='smallint[]', counts='integer[]')
+
+
+def get_bucket(timestamp: int) -> int:
+    return timestamp - timestamp % STATS_BUCKET
+
+
+def backfill(curs):
+    """Fills an empty flag_stats from the stored flags, e.g. for the databases created before it.
+
+    Otherwise the flags queued before the upgrade would be subtracted from QUEUED when submitted.
+    """
+    curs.execute('SELECT EXISTS (SELECT 1 FROM flag_stats) AS filled')
+    if curs.fetchone()['filled']:
+        return
+    curs.execute(
+        """
+        INSERT INTO flag_stats (bucket, sploit_id, team_id, status, count)
+        SELECT time - time %% %(bucket)s, sploit_id, team_id, status, COUNT(*)
+        FROM all_flags
+        GROUP BY 1, 2, 3, 4
+        """,
+        {'bucket': STATS_BUCKET},
+    )
+
+
+def record_transitions(curs, transitions: Iterable[tuple[int, int, int, int, int]]):
+    """Apply (time, sploit id, team id, old status, new status) changes to flag_stats.
+
+    Statuses are FlagStatus values. The ingest statement accounts for the new flags itself.
+    """
+    deltas: dict[tuple[int, int, int, int], int] = defaultdict(int)
+    for timestamp, sploit_id, team_id, old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        bucket = get_bucket(timestamp)
+        deltas[bucket, sploit_id, team_id, old_status] -= 1
+        deltas[bucket, sploit_id, team_id, new_status] += 1
+
+    deltas = {key: value for key, value in deltas.items() if value != 0}
+    if not deltas:
+        return
+
+    keys, values = zip(*deltas.items())
+    buckets, sploit_ids, team_ids, statuses = map(list, zip(*keys))
+    UPSERT.execute(curs, {
+        'buckets': buckets,
+        'sploit_ids': sploit_ids,
+        'team_ids': team_ids,
+        'statuses': statuses,
+        'counts': list(values),
+    })
+
+
+def get_stats(curs, since: int, until: int, step: int,
+              sploit: Optional[str] = None, team: Optional[str] = None) -> list[dict]:
+    conditions = ['bucket >= %s', 'bucket <= %s']
+    args = [get_bucket(since), until]
+    # Unknown names give no rows, as `= NULL` never matches.
+    if sploit:
+        conditions.append('sploit_id = %s')
+        args.append(dictionaries.sploits.find_id(curs, sploit))
+    if team:
+        conditions.append('team_id = %s')
+        args.append(dictionaries.teams.find_id(curs, team))
+
+    curs.execute(
+        f"""
+        SELECT bucket - bucket %% %s AS time, sploit_id, team_id, status, SUM(count) AS count
+        FROM flag_stats
+        WHERE {' AND '.join(conditions)}
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(count) <> 0
+        ORDER BY 1, 2, 3, 4
+        """,
+        [step] + args,
+    )
+    return dictionaries.decode_rows(curs, curs.fetchall())
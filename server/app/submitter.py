@@ -0,0 +1,128 @@
+"""
+Submit daemon for SUBMIT_MODE = 'daemon', an alternative to the submit_flags beat task.
+
+It runs the same submit cycle in a loop, with the config, the protocol state and the
+database connections kept warm. Ingest sends NOTIFY after committing new flags,
+so they are submitted right away instead of waiting for the next tick. The budget
+from the limiter is spent within SUBMIT_PERIOD windows: once it's used up, the daemon
+sleeps until the window ends.
+
+Usage: python submitter.py (with the app directory on PYTHONPATH, like celery).
+"""
+
+import logging
+import select
+import time
+
+import psycopg2
+from prometheus_client import Counter, start_http_server
+
+import reloader
+import tasks
+from constants import POSTGRES_DSN
+from ingest import QUEUED_CHANNEL
+from limiter import limiter
+from log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Pause between the checks of SUBMIT_MODE while the beat task is in charge,
+# and before retrying after an error.
+IDLE_INTERVAL = 1
+
+SUBMITTER_WAKEUPS = Counter(
+    'submitter_wakeups',
+    'Number of submit daemon wakeups',
+    ['reason'],
+)
+
+
+class Submitter:
+    def __init__(self):
+        self.listen_conn = None
+        self.window_start = None
+        self.budget = 0
+        self.used = 0
+        self.results = []
+
+    def listen(self):
+        self.listen_conn = psycopg2.connect(POSTGRES_DSN)
+        self.listen_conn.autocommit = True
+        with self.listen_conn.cursor() as curs:
+            curs.execute(f'LISTEN {QUEUED_CHANNEL}')
+
+    def wait(self, timeout: float) -> bool:
+        """Waits for the notifications up to `timeout` seconds, returns whether there were any."""
+        if timeout > 0:
+            select.select([self.listen_conn], [], [], timeout)
+        self.listen_conn.poll()
+        notified = bool(self.listen_conn.notifies)
+        self.listen_conn.notifies.clear()
+        return notified
+
+    def start_window(self, snapshot, now: float):
+        """Feeds the results of the finished window to the limiter and takes the next budget."""
+        config = snapshot.config
+        if self.window_start is not None:
+            limiter.update(config, self.budget, self.results, snapshot.protocol)
+        self.window_start = now
+        self.budget = limiter.get_budget(config)
+        self.used = 0
+        self.results = []
+
+    def step(self):
+        snapshot = reloader.get_snapshot()
+        config = snapshot.config
+        if config.get('SUBMIT_MODE', 'beat') != 'daemon':
+            self.window_start = None
+            time.sleep(IDLE_INTERVAL)
+            return
+
+        now = time.monotonic()
+        if self.window_start is None or now >= self.window_start + config['SUBMIT_PERIOD']:
+            self.start_window(snapshot, now)
+
+        remaining = self.budget - self.used
+        idle = True
+        if remaining > 0:
+            cycle = tasks.submit_cycle(snapshot, budget=remaining)
+            self.used += cycle.submitted
+            self.results += cycle.results
+            # Less than the budget was taken, so the queue has nothing more to submit now.
+            idle = cycle.submitted < remaining
+
+        window_left = self.window_start + config['SUBMIT_PERIOD'] - time.monotonic()
+        if idle:
+            # New flags can be submitted with the rest of the budget right away. Without them
+            # the next window runs a cycle anyway, to skip the expired flags and retry the queued ones.
+            reason = 'notify' if self.wait(window_left) else 'period'
+        else:
+            time.sleep(max(window_left, 0))
+            # Flags that arrived meanwhile are picked up by the next cycle.
+            self.wait(0)
+            reason = 'budget'
+        SUBMITTER_WAKEUPS.labels(reason=reason).inc()
+
+    def run(self):
+        while True:
+            try:
+                if self.listen_conn is None or self.listen_conn.closed:
+                    self.listen()
+                self.step()
+            except Exception as e:
+                logger.exception('Submit daemon step failed: %s', e)
+                # The listening connection is reopened, it may be the one that failed.
+                if self.listen_conn is not None:
+                    self.listen_conn.close()
+                time.sleep(IDLE_INTERVAL)
+
+
+def main():
+    setup_logging('INFO')
+    start_http_server(port=5000)
+    logger.info('Starting the submit daemon')
+    Submitter().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,26 @@
+import random
+import threading
 import time
-from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
+import dictionaries
+import events
+import ingest_buffer
+import partitions
 import reloader
+import scheduler
+import stats
 from database import db_cursor
-from models import Flag, FlagStatus
-from utils import get_fair_share, submit_flags
+from limiter import limiter
+from models import Flag, FlagStatus, SubmitCycle
+from reloader import ConfigSnapshot
+from statements import PreparedStatement
+from utils import submit_flags
 
 logger = get_task_logger(__name__)
 
@@ -29,60 +41,258 @@ FLAGS_TIMED_OUT = Counter(
     'Number of flags timed out',
 )
 
+FLAGS_EXPIRED = Counter(
+    'flags_expired',
+    'Number of flags that reached FLAG_LIFETIME while queued',
+    ['sploit', 'team'],
+)
+
+FLAG_SUBMIT_AGE = Histogram(
+    'flag_submit_age_seconds',
+    'Age of flags at the moment of submission',
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 180, 240, 300, 600),
+)
+
+SUBMIT_PHASE_SECONDS = Histogram(
+    'submit_phase_seconds',
+    'Duration of the submit cycle phases',
+    ['phase'],
+)
+
+# ORDER BY clauses for the SUBMIT_ORDER config option.
+SUBMIT_ORDERS = {
+    'random': 'random()',
+    'deadline': 'time',
+}
+
+# Moves the expired flags from the queue to the history as SKIPPED.
+SKIP_EXPIRED = PreparedStatement('skip_expired', """
+WITH skipped AS (
+    DELETE FROM flags_queue WHERE time < %(skip_time)s RETURNING *
+),
+moved AS (
+    INSERT INTO flags (flag, sploit_id, team_id, time, status, checksystem_response)
+    SELECT flag, sploit_id, team_id, time, %(status)s, checksystem_response FROM skipped
+)
+SELECT flag, sploit_id, team_id, time, checksystem_response FROM skipped
+""", skip_time='integer', status='smallint')
+
+QUEUED_GROUPS = PreparedStatement('queued_groups', """
+SELECT sploit_id, team_id, COUNT(*) AS cnt, MIN(time) AS oldest
+FROM flags_queue GROUP BY sploit_id, team_id
+""")
+
+# Takes up to `quota` flags of each group.
+SELECT_QUEUED = {
+    order: PreparedStatement(f'select_queued_{order}', f"""
+    SELECT selected.* FROM unnest(%(sploit_ids)s::integer[], %(team_ids)s::integer[], %(quotas)s::integer[])
+        AS quotas(sploit_id, team_id, quota)
+    CROSS JOIN LATERAL (
+        SELECT * FROM flags_queue
+        WHERE sploit_id = quotas.sploit_id AND team_id = quotas.team_id
+        ORDER BY {clause}
+        LIMIT quotas.quota
+    ) AS selected
+    """, sploit_ids='integer[]', team_ids='integer[]', quotas='integer[]')
+    for order, clause in SUBMIT_ORDERS.items()
+}
+
+# All results are applied with a single statement: flags with a final verdict
+# move from the queue to the history, the rest stay queued with the new response.
+# A flag can be skipped by the sweep of a concurrent cycle while it's being submitted
+# (a slow checksystem, deadline order), then its final verdict replaces SKIPPED in the history.
+SAVE_RESULTS = PreparedStatement('save_results', """
+WITH results AS (
+    SELECT * FROM unnest(%(flags)s::text[], %(times)s::integer[], %(statuses)s::smallint[], %(responses)s::text[])
+        AS results(flag, time, status, response)
+),
+finished AS (
+    DELETE FROM flags_queue USING results
+    WHERE flags_queue.flag = results.flag AND results.status <> %(queued)s
+    RETURNING flags_queue.flag, flags_queue.sploit_id, flags_queue.team_id, flags_queue.time,
+        results.status, results.response
+),
+moved AS (
+    INSERT INTO flags (flag, sploit_id, team_id, time, status, checksystem_response)
+    SELECT flag, sploit_id, team_id, time, status, response FROM finished
+),
+retried AS (
+    UPDATE flags_queue SET checksystem_response = results.response
+    FROM results
+    WHERE flags_queue.flag = results.flag AND results.status = %(queued)s
+),
+late AS (
+    UPDATE flags SET status = results.status, checksystem_response = results.response
+    FROM results
+    WHERE flags.flag = results.flag AND flags.time = results.time
+        AND flags.status = %(skipped)s AND results.status <> %(queued)s
+    RETURNING flags.flag, flags.sploit_id, flags.team_id, flags.time, results.status, results.response
+)
+SELECT flag, time, sploit_id, team_id, %(queued)s AS old_status, status, response FROM finished
+UNION ALL
+SELECT flag, time, sploit_id, team_id, %(skipped)s AS old_status, status, response FROM late
+""", flags='text[]', times='integer[]', statuses='smallint[]', responses='text[]', queued='smallint', skipped='smallint')
+
+_queued_labels_lock = threading.Lock()
+_queued_labels: set[tuple[str, str]] = set()
+
+
+def update_queued_gauge(queued_by_labels: dict[tuple[str, str], int]):
+    global _queued_labels
+    with _queued_labels_lock:
+        # Reset the groups that have been drained since the last tick.
+        for sploit, team in _queued_labels - queued_by_labels.keys():
+            FLAGS_QUEUED.labels(sploit=sploit, team=team).set(0)
+        for (sploit, team), value in queued_by_labels.items():
+            FLAGS_QUEUED.labels(sploit=sploit, team=team).set(value)
+        _queued_labels = set(queued_by_labels)
+
 
 @shared_task
 def submit_flags_task():
+    snapshot = reloader.get_snapshot()
+    if snapshot.config.get('SUBMIT_MODE', 'beat') == 'daemon':
+        # The flags are submitted by submitter.py.
+        return
     logger.info('Starting submit_flags task')
+    submit_cycle(snapshot)
+
+
+@shared_task
+def maintain_partitions_task():
+    now = round(time.time())
     config = reloader.get_config()
+    oldest_buffered = ingest_buffer.oldest_time()
+    with db_cursor(True) as (conn, curs):
+        partitions.ensure_partitions(curs, now)
+        conn.commit()
+        detached = partitions.apply_retention(conn, curs, now, config['FLAG_LIFETIME'], oldest_buffered)
+    if detached:
+        logger.info('Detached %s expired partitions', len(detached))
+
+
+@shared_task
+def flush_ingest_buffer_task():
+    # Runs in the 'direct' mode too: the batches buffered before a switch back still have to be flushed.
+    flushed = ingest_buffer.flush()
+    if flushed:
+        logger.info('Flushed %s buffered flags', flushed)
+
+
+@contextmanager
+def timed_phase(cycle: SubmitCycle, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        cycle.timings[name] = elapsed
+        SUBMIT_PHASE_SECONDS.labels(phase=name).observe(elapsed)
+
+
+def submit_cycle(snapshot: ConfigSnapshot, budget: Optional[int] = None) -> SubmitCycle:
+    """Skips expired flags, selects a share of the queue, submits it and saves the results.
+
+    The number of flags to submit comes from the limiter unless `budget` is given,
+    then the caller is responsible for updating the limiter (see submitter.py).
+    """
+    cycle = SubmitCycle()
+    config = snapshot.config
     now = time.time()
     skip_time = round(now - config['FLAG_LIFETIME'])
 
-    with db_cursor(True) as (conn, curs):
-        curs.execute(
-            """
-            UPDATE flags SET status = %s WHERE status = %s AND time < %s
-            """,
-            (FlagStatus.SKIPPED.name, FlagStatus.QUEUED.name, skip_time),
-        )
-        skipped_flags = curs.rowcount
+    with timed_phase(cycle, 'select'), db_cursor(True) as (conn, curs):
+        SKIP_EXPIRED.execute(curs, {'skip_time': skip_time, 'status': FlagStatus.SKIPPED.value})
+        skipped = curs.fetchall()
+        skipped_flags = len(skipped)
+        if skipped_flags:
+            stats.record_transitions(curs, (
+                (item['time'], item['sploit_id'], item['team_id'], FlagStatus.QUEUED.value, FlagStatus.SKIPPED.value)
+                for item in skipped
+            ))
         conn.commit()
-        curs.execute(
-            """
-            SELECT * FROM flags WHERE status = %s
-            """,
-            (FlagStatus.QUEUED.name,),
-        )
-        queued_flags = [Flag(**item) for item in curs.fetchall()]
-
-    logger.info('Flags in queue: %s, skipped: %s', len(queued_flags), skipped_flags)
-    FLAGS_TIMED_OUT.inc(skipped_flags)
+        QUEUED_GROUPS.execute(curs)
+        queued_groups = curs.fetchall()
+        queued_flags = sum(item['cnt'] for item in queued_groups)
 
-    queued_by_labels: dict[(str, str), int] = defaultdict(int)
-    for item in queued_flags:
-        queued_by_labels[item.sploit, item.team] += 1
-    for key, value in queued_by_labels.items():
-        FLAGS_QUEUED.labels(sploit=key[0], team=key[1]).set(value)
+        # Names for the metrics and SPLOIT_WEIGHTS, they are cached in process.
+        sploit_names = dictionaries.sploits.get_names(curs, (item['sploit_id'] for item in skipped + queued_groups))
+        team_names = dictionaries.teams.get_names(curs, (item['team_id'] for item in skipped + queued_groups))
+        for item in skipped + queued_groups:
+            item['sploit'] = sploit_names.get(item['sploit_id'])
+            item['team'] = team_names.get(item['team_id'])
+        for item in skipped:
+            FLAGS_EXPIRED.labels(sploit=item['sploit'], team=item['team']).inc()
 
-    if queued_flags:
-        grouped_flags: dict[(str, str), list[Flag]] = defaultdict(list)
-        for item in queued_flags:
-            grouped_flags[item.sploit, item.team].append(item)
-        flags = get_fair_share(list(grouped_flags.values()), config['SUBMIT_FLAG_LIMIT'])
+        # Quotas are computed from the group sizes only, the database returns just the selected rows.
+        # In the deadline mode the oldest flags are taken from each group (earliest deadline first).
+        order = config.get('SUBMIT_ORDER', 'random')
+        deadline = order == 'deadline'
+        adaptive = budget is None
+        if adaptive:
+            budget = limiter.get_budget(config)
+        quotas = scheduler.get_quotas(curs, queued_groups, budget, config)
+        selected_groups = [(item, quota) for item, quota in zip(queued_groups, quotas) if quota > 0]
+        if selected_groups:
+            SELECT_QUEUED[order].execute(curs, {
+                'sploit_ids': [item['sploit_id'] for item, _ in selected_groups],
+                'team_ids': [item['team_id'] for item, _ in selected_groups],
+                'quotas': [quota for _, quota in selected_groups],
+            })
+            flags = [
+                Flag(
+                    flag=item['flag'],
+                    sploit=sploit_names.get(item['sploit_id']),
+                    team=team_names.get(item['team_id']),
+                    time=item['time'],
+                    status=FlagStatus.QUEUED,
+                    checksystem_response=item['checksystem_response'],
+                )
+                for item in curs.fetchall()
+            ]
+        else:
+            flags = []
+        conn.commit()
 
-        flag_by_text = {item.flag: item for item in queued_flags}
+    events.publish([
+        {
+            'flag': item['flag'],
+            'sploit': item['sploit'],
+            'team': item['team'],
+            'time': item['time'],
+            'status': FlagStatus.SKIPPED.name,
+            'checksystem_response': item['checksystem_response'],
+        }
+        for item in skipped
+    ])
 
-        logger.info('Submitting %s/%s queued flags', len(flags), len(queued_flags))
+    cycle.queued = queued_flags
+    cycle.skipped = skipped_flags
+    logger.info('Flags in queue: %s, skipped: %s', queued_flags, skipped_flags)
+    FLAGS_TIMED_OUT.inc(skipped_flags)
 
-        results = submit_flags(flags, config)
+    update_queued_gauge({(item['sploit'], item['team']): item['cnt'] for item in queued_groups})
 
-        rows = []
-        for submit_result in results:
-            rows.append((
-                submit_result.status.name,
-                submit_result.checksystem_response,
-                submit_result.flag,
-            ))
+    if flags:
+        if deadline:
+            flags.sort(key=lambda item: item.time)
+        else:
+            random.shuffle(flags)
+        for item in flags:
+            FLAG_SUBMIT_AGE.observe(now - item.time)
+        flag_by_text = {item.flag: item for item in flags}
+
+        logger.info('Submitting %s/%s queued flags', len(flags), queued_flags)
+
+        with timed_phase(cycle, 'submit'):
+            # Protocols that enforce the limit on their own should see the current budget.
+            results = submit_flags(flags, snapshot, dict(config, SUBMIT_FLAG_LIMIT=budget))
+            if adaptive:
+                limiter.update(config, budget, results, snapshot.protocol)
+        cycle.submitted = len(results)
+        cycle.results = results
 
+        for submit_result in results:
             flag = flag_by_text[submit_result.flag]
             FLAGS_SUBMITTED.labels(
                 sploit=flag.sploit,
@@ -90,11 +300,36 @@ def submit_flags_task():
                 status=submit_result.status.name,
             ).inc()
 
-        with db_cursor(True) as (conn, curs):
-            curs.executemany(
-                """
-                UPDATE flags SET status = %s, checksystem_response = %s WHERE flag = %s
-                """,
-                rows,
-            )
+        with timed_phase(cycle, 'update'), db_cursor(True) as (conn, curs):
+            SAVE_RESULTS.execute(curs, {
+                'flags': [item.flag for item in results],
+                'times': [flag_by_text[item.flag].time for item in results],
+                'statuses': [item.status.value for item in results],
+                'responses': [item.checksystem_response for item in results],
+                'queued': FlagStatus.QUEUED.value,
+                'skipped': FlagStatus.SKIPPED.value,
+            })
+            updated = curs.fetchall()
+
+            stats.record_transitions(curs, (
+                (item['time'], item['sploit_id'], item['team_id'], item['old_status'], item['status'])
+                for item in updated
+            ))
             conn.commit()
+
+        events.publish([
+            {
+                'flag': item['flag'],
+                'sploit': flag_by_text[item['flag']].sploit,
+                'team': flag_by_text[item['flag']].team,
+                'time': item['time'],
+                'status': FlagStatus(item['status']).name,
+                'checksystem_response': item['response'],
+            }
+            for item in updated
+        ])
+    elif adaptive:
+        # Nothing was submitted, the measured submit rate goes down too.
+        limiter.update(config, budget, [], snapshot.protocol)
+
+    return cycle
@@ -1,32 +1,36 @@
-import importlib
 import logging
 import random
 import traceback
-from typing import List, TypeVar
+from typing import List, Mapping, Optional, TypeVar
 
 from models import Flag, FlagStatus, SubmitResult
+from reloader import ConfigSnapshot
 
 T = TypeVar('T')
 
 logger = logging.getLogger(__name__)
 
 
-def get_fair_share(groups: List[List[T]], limit: int) -> List[T]:
-    if not groups:
-        return []
+def get_fair_quotas(sizes: List[int], limit: int, priorities: Optional[List] = None) -> List[int]:
+    """
+    Max-min fair split of `limit` places between groups of the given sizes.
+    The places that can't be split evenly go to random groups or, if `priorities`
+    are given, to the groups with the lowest priority values.
+    """
+    quotas = [0] * len(sizes)
+    if not sizes:
+        return quotas
 
-    groups = sorted(groups, key=len)
     places_left = limit
-    group_count = len(groups)
+    group_count = len(sizes)
     fair_share = places_left // group_count
 
-    result = []
     residuals = []
-    for group in groups:
-        if len(group) <= fair_share:
-            result += group
+    for i in sorted(range(len(sizes)), key=sizes.__getitem__):
+        if sizes[i] <= fair_share:
+            quotas[i] = sizes[i]
 
-            places_left -= len(group)
+            places_left -= sizes[i]
             group_count -= 1
             if group_count > 0:
                 fair_share = places_left // group_count
@@ -34,22 +38,40 @@ def get_fair_share(groups: List[List[T]], limit: int) -> List[T]:
             # had a few elements. Sorting order guarantees that the smaller
             # groups will be processed first.
         else:
-            selected = random.sample(group, fair_share + 1)
-            result += selected[:-1]
-            residuals.append(selected[-1])
-    result += random.sample(residuals, min(limit - len(result), len(residuals)))
+            quotas[i] = fair_share
+            residuals.append(i)
+
+    # The places left after the integer division go to the big groups, one per group.
+    places_left = min(limit - sum(quotas), len(residuals))
+    if priorities is None:
+        lucky = random.sample(residuals, places_left)
+    else:
+        lucky = sorted(residuals, key=priorities.__getitem__)[:places_left]
+    for i in lucky:
+        quotas[i] += 1
+
+    return quotas
+
+
+def get_fair_share(groups: List[List[T]], limit: int) -> List[T]:
+    quotas = get_fair_quotas([len(group) for group in groups], limit)
+
+    result = []
+    for group, quota in zip(groups, quotas):
+        result += random.sample(group, quota)
 
     random.shuffle(result)
     return result
 
 
-def submit_flags(flags: List[Flag], config) -> List[SubmitResult]:
-    module_path = 'protocols.' + config['SYSTEM_PROTOCOL']
-    logger.debug('importing the protocol from %s', module_path)
-    module = importlib.import_module(module_path)
+def submit_flags(flags: List[Flag], snapshot: ConfigSnapshot, config: Optional[Mapping] = None) -> List[SubmitResult]:
+    """Submits flags with the snapshot's protocol, `config` overrides the snapshot's config."""
+    config = config or snapshot.config
 
     try:
-        return list(module.submit_flags(flags, config))
+        if snapshot.protocol is None:
+            raise ImportError(f'protocol {config["SYSTEM_PROTOCOL"]} is not available')
+        return list(snapshot.protocol.submit_flags(flags, config))
     except Exception as e:
         message = '{}: {}'.format(type(e).__name__, str(e))
         logger.error('Exception in submit protocol: %s\n%s', message, traceback.format_exc())
@@ -0,0 +1,78 @@
+"""
+Compares the bulk ingest path of /api/post_flags with the old
+executemany-based one.
+
+Usage: POSTGRES_DSN='host=localhost dbname=farm_bench' python bench_ingest.py
+"""
+
+import argparse
+import statistics
+import time
+
+from common import db_cursor, make_flags, print_table, reset_flags, timer
+
+import dictionaries
+import ingest
+
+LEGACY_SQL = """
+INSERT INTO flags_queue (flag, sploit_id, team_id, time)
+VALUES (%(flag)s, %(sploit_id)s, %(team_id)s, %(time)s)
+ON CONFLICT DO NOTHING
+"""
+
+
+def legacy_insert(flags, cur_time):
+    with db_cursor() as (conn, curs):
+        sploit_ids = dictionaries.sploits.get_ids(curs, (item['sploit'] for item in flags))
+        team_ids = dictionaries.teams.get_ids(curs, (item['team'] for item in flags))
+        rows = [
+            dict(flag=item['flag'], sploit_id=sploit_ids[item['sploit']], team_id=team_ids[item['team']], time=cur_time)
+            for item in flags
+        ]
+        curs.executemany(LEGACY_SQL, rows)
+        conn.commit()
+
+
+def bulk_insert(flags, cur_time):
+    with db_cursor() as (conn, curs):
+        ingest.insert_flags(curs, flags, cur_time)
+        conn.commit()
+
+
+def measure(insert, flags, repeat, duplicates):
+    timings = []
+    for _ in range(repeat):
+        reset_flags()
+        if duplicates:
+            bulk_insert(flags, round(time.time()))
+        with timer(timings):
+            insert(flags, round(time.time()))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        flags = make_flags(size)
+        for duplicates in [False, True]:
+            legacy = measure(legacy_insert, flags, args.repeat, duplicates)
+            bulk = measure(bulk_insert, flags, args.repeat, duplicates)
+            rows.append([
+                size,
+                'duplicates' if duplicates else 'new',
+                f'{legacy * 1000:.1f}',
+                f'{bulk * 1000:.1f}',
+                f'{legacy / bulk:.1f}x',
+            ])
+
+    reset_flags()
+    print_table(['flags', 'batch', 'executemany, ms', 'bulk, ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
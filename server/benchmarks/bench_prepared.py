@@ -0,0 +1,155 @@
+"""
+Compares the hot statements of the ingest and submit paths sent as plain queries and
+as server-side prepared statements (statements.py). For each statement it reports the
+planning time from EXPLAIN ANALYZE and the wall time of a call. Every call is rolled
+back, so all runs see the same seeded queue.
+
+Usage: POSTGRES_DSN='host=localhost dbname=farm_bench' python bench_prepared.py --queue 20000 --batch 100
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from common import db_cursor, make_flags, print_table, reset_flags
+
+import ingest
+import stats
+import tasks
+from models import FlagStatus
+
+
+def seed(count: int):
+    reset_flags()
+    flags = make_flags(count)
+    with db_cursor(True) as (conn, curs):
+        for i in range(0, len(flags), 10000):
+            ingest.insert_flags(curs, flags[i:i + 10000], round(time.time()))
+        conn.commit()
+
+
+def make_cases(curs, batch: int) -> list:
+    """Returns (name, statement, params factory) of the measured statements."""
+    now = round(time.time())
+    curs.execute('SELECT sploit_id, team_id FROM flags_queue GROUP BY sploit_id, team_id')
+    groups = curs.fetchall()
+    curs.execute('SELECT flag, sploit_id, team_id, time FROM flags_queue LIMIT %s', (batch,))
+    queued = curs.fetchall()
+    sploit_ids = [item['sploit_id'] for item in queued]
+    team_ids = [item['team_id'] for item in queued]
+
+    def new_flags():
+        return {
+            'flags': [item['flag'] for item in make_flags(batch)],
+            'sploit_ids': [random.choice(sploit_ids) for _ in range(batch)],
+            'team_ids': [random.choice(team_ids) for _ in range(batch)],
+            'time': now,
+            'bucket': stats.get_bucket(now),
+            'status': FlagStatus.QUEUED.value,
+        }
+
+    def selection():
+        return {
+            'sploit_ids': [item['sploit_id'] for item in groups],
+            'team_ids': [item['team_id'] for item in groups],
+            'quotas': [max(batch // len(groups), 1)] * len(groups),
+        }
+
+    def results():
+        return {
+            'flags': [item['flag'] for item in queued],
+            'times': [item['time'] for item in queued],
+            'statuses': [random.choice([FlagStatus.ACCEPTED, FlagStatus.REJECTED, FlagStatus.QUEUED]).value
+                         for _ in queued],
+            'responses': ['ok'] * len(queued),
+            'queued': FlagStatus.QUEUED.value,
+            'skipped': FlagStatus.SKIPPED.value,
+        }
+
+    def transitions():
+        # One row per group: an upsert can't update the same row twice.
+        return {
+            'buckets': [stats.get_bucket(now)] * len(groups),
+            'sploit_ids': [item['sploit_id'] for item in groups],
+            'team_ids': [item['team_id'] for item in groups],
+            'statuses': [FlagStatus.ACCEPTED.value] * len(groups),
+            'counts': [1] * len(groups),
+        }
+
+    return [
+        ('ingest', ingest.INSERT_FLAGS, new_flags),
+        ('skip expired', tasks.SKIP_EXPIRED, lambda: {'skip_time': now - 3600, 'status': FlagStatus.SKIPPED.value}),
+        ('queued groups', tasks.QUEUED_GROUPS, lambda: None),
+        ('select queued', tasks.SELECT_QUEUED['deadline'], selection),
+        ('save results', tasks.SAVE_RESULTS, results),
+        ('flag stats', stats.UPSERT, transitions),
+    ]
+
+
+def run(conn, curs, statement, params, prepared: bool, explain: bool):
+    query = statement.execute_sql if prepared else statement.query
+    if prepared:
+        statement.prepare(curs)
+    if explain:
+        query = 'EXPLAIN (ANALYZE, FORMAT JSON) ' + query
+    curs.execute(query, params)
+    # The flag_stats upsert returns no rows.
+    rows = curs.fetchall() if curs.description else []
+    conn.rollback()
+    return rows
+
+
+def measure(conn, curs, statement, make_params, prepared: bool, repeat: int, warmup: int):
+    # The server picks between custom and generic plans after the first five executions.
+    for _ in range(warmup):
+        run(conn, curs, statement, make_params(), prepared, explain=False)
+
+    planning = []
+    for _ in range(repeat):
+        plan = run(conn, curs, statement, make_params(), prepared, explain=True)[0]['QUERY PLAN'][0]
+        planning.append(plan['Planning Time'])
+
+    wall = []
+    for _ in range(repeat):
+        params = make_params()
+        start = time.perf_counter()
+        run(conn, curs, statement, params, prepared, explain=False)
+        wall.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(planning), statistics.median(wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queue', type=int, default=20000, help='flags in the queue')
+    parser.add_argument('--batch', type=int, default=100, help='flags per ingest batch and per submit results')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=10)
+    args = parser.parse_args()
+
+    seed(args.queue)
+
+    rows = []
+    with db_cursor(True) as (conn, curs):
+        for name, statement, make_params in make_cases(curs, args.batch):
+            plain_plan, plain_wall = measure(conn, curs, statement, make_params, False, args.repeat, args.warmup)
+            prepared_plan, prepared_wall = measure(conn, curs, statement, make_params, True, args.repeat, args.warmup)
+            rows.append([
+                name,
+                f'{plain_plan:.3f}',
+                f'{prepared_plan:.3f}',
+                f'{plain_wall:.2f}',
+                f'{prepared_wall:.2f}',
+                f'{plain_wall / prepared_wall:.2f}x',
+            ])
+
+    reset_flags()
+    print_table(
+        ['statement', 'planning, ms', 'prepared planning, ms', 'call, ms', 'prepared call, ms', 'speedup'],
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
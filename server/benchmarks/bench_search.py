@@ -0,0 +1,110 @@
+"""
+Measures substring search in /api/filter_flags on a large flags table:
+the old POSITION() predicate (sequential scan) against the LIKE predicate
+served by the trigram indexes.
+
+Usage: POSTGRES_DSN='host=localhost dbname=farm_bench' python bench_search.py --rows 5000000
+"""
+
+import argparse
+import statistics
+import time
+
+from common import db_cursor, print_table, reset_flags, timer
+
+import dictionaries
+import partitions
+from api import build_where, parse_flag_filters
+
+SEED_SQL = """
+INSERT INTO flags (flag, sploit_id, team_id, time, status, checksystem_response)
+SELECT
+    UPPER(SUBSTR(MD5(i::text) || MD5((-i)::text), 1, 31)) || '=',
+    (%(sploit_ids)s::integer[])[i % 20 + 1],
+    (%(team_ids)s::integer[])[i % 50 + 1],
+    %(now)s - i / 100,
+    (ARRAY[1, 1, 2, 3])[i % 4 + 1],
+    (ARRAY[NULL, 'Flag is too old', 'Accepted. ' || i || ' flag points', 'Denied: invalid flag'])[i % 4 + 1]
+FROM generate_series(1, %(rows)s) AS i
+"""
+
+PAGE_SQL = 'SELECT * FROM all_flags {} ORDER BY time DESC, flag DESC LIMIT 30'
+COUNT_SQL = 'SELECT COUNT(*) AS cnt FROM all_flags {}'
+
+
+def seed(rows):
+    reset_flags()
+    now = round(time.time())
+    with db_cursor() as (conn, curs):
+        sploit_ids = dictionaries.sploits.get_ids(curs, [f'sploit_{i}' for i in range(20)])
+        team_ids = dictionaries.teams.get_ids(curs, [f'Team #{i}' for i in range(50)])
+        partitions.create_partitions(curs, now - rows // 100, now + 1)
+        curs.execute(SEED_SQL, {
+            'now': now,
+            'rows': rows,
+            'sploit_ids': [sploit_ids[f'sploit_{i}'] for i in range(20)],
+            'team_ids': [team_ids[f'Team #{i}'] for i in range(50)],
+        })
+        conn.commit()
+    with db_cursor() as (conn, curs):
+        conn.autocommit = True
+        curs.execute('VACUUM ANALYZE flags')
+        conn.autocommit = False
+
+
+def sample_flag():
+    with db_cursor() as (_, curs):
+        curs.execute('SELECT flag FROM flags ORDER BY time LIMIT 1 OFFSET 1000')
+        return curs.fetchone()['flag']
+
+
+def legacy_where(filters):
+    chunks = [f'POSITION(%s in LOWER({column})) > 0' for column in filters]
+    return 'WHERE ' + ' AND '.join(chunks), [value.lower() for value in filters.values()]
+
+
+def measure(where, repeat):
+    conditions_sql, conditions_args = where
+    timings = []
+    with db_cursor() as (_, curs):
+        for _ in range(repeat):
+            with timer(timings):
+                curs.execute(PAGE_SQL.format(conditions_sql), conditions_args)
+                curs.fetchall()
+                curs.execute(COUNT_SQL.format(conditions_sql), conditions_args)
+                curs.fetchone()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the rows from the previous run')
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        print(f'Seeding {args.rows} flags...')
+        seed(args.rows)
+
+    flag = sample_flag()
+    searches = {
+        'full flag': {'flag': flag},
+        'flag substring': {'flag': flag[5:15]},
+        'response substring': {'checksystem_response': 'points'},
+        'rare response': {'checksystem_response': '12345 flag'},
+    }
+
+    rows = []
+    for name, filters in searches.items():
+        legacy = measure(legacy_where(filters), args.repeat)
+        with db_cursor() as (_, curs):
+            where = build_where(parse_flag_filters(curs, filters))
+        indexed = measure(where, args.repeat)
+        rows.append([name, f'{legacy * 1000:.1f}', f'{indexed * 1000:.1f}', f'{legacy / indexed:.1f}x'])
+
+    print_table(['search', 'POSITION, ms', 'trigram, ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
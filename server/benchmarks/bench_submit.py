@@ -0,0 +1,125 @@
+"""
+End-to-end submit benchmark: seeds the flags table and drains it with the real
+submit cycle (select, submit, update) against the local checksystem emulator.
+Reports the throughput and the latency of each phase of a tick.
+
+Usage: python bench_submit.py --dialect faust --flags 20000 --limit 500 --latency 0.0005
+"""
+
+import argparse
+import statistics
+import time
+
+from common import make_flags, print_table, reset_flags
+
+import config
+import ingest
+import reloader
+import tasks
+from database import db_cursor
+from emulator import DIALECTS, Checksystem, Settings, start_server
+from models import FlagStatus
+
+PHASES = ['select', 'submit', 'update']
+
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[round(q * 100) - 1]
+
+
+def seed(count: int, sploits: int, teams: int):
+    reset_flags()
+    flags = make_flags(count, sploits=sploits, teams=teams)
+    with db_cursor(True) as (conn, curs):
+        for i in range(0, len(flags), 10000):
+            ingest.insert_flags(curs, flags[i:i + 10000], round(time.time()))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialect', choices=DIALECTS, default='ructf_tcp')
+    parser.add_argument('--flags', type=int, default=10000)
+    parser.add_argument('--sploits', type=int, default=10)
+    parser.add_argument('--teams', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=500, help='SUBMIT_FLAG_LIMIT')
+    parser.add_argument('--adaptive', action='store_true', help='enable SUBMIT_ADAPTIVE')
+    parser.add_argument('--scheduler', choices=['fair', 'drr'], default='drr')
+    parser.add_argument('--order', choices=sorted(tasks.SUBMIT_ORDERS), default='deadline')
+    parser.add_argument('--max-ticks', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='checksystem time per flag, seconds')
+    parser.add_argument('--accept', type=float, default=0.8)
+    parser.add_argument('--reject', type=float, default=0.15)
+    parser.add_argument('--rate', type=int, help='checksystem rate limit, flags per --period')
+    parser.add_argument('--period', type=float, default=1.0)
+    args = parser.parse_args()
+
+    checksystem = Checksystem(Settings(
+        latency=args.latency, accept=args.accept, reject=args.reject, rate=args.rate, period=args.period,
+    ))
+    server = start_server(args.dialect, checksystem)
+    host, port = server.server_address
+
+    snapshot = reloader.build_snapshot(dict(
+        config.CONFIG,
+        SYSTEM_PROTOCOL=args.dialect,
+        SYSTEM_HOST=f'{host}:{port}' if args.dialect == 'volgactf' else host,
+        SYSTEM_PORT=port,
+        SYSTEM_URL=f'http://{host}:{port}/flags',
+        SYSTEM_SCHEME='http',
+        SYSTEM_TOKEN='benchmark',
+        INFO_FLAG_LIMIT=args.limit,
+        SUBMIT_FLAG_LIMIT=args.limit,
+        SUBMIT_FLAG_LIMIT_MAX=max(args.limit, config.CONFIG.get('SUBMIT_FLAG_LIMIT_MAX', 0)),
+        SUBMIT_ADAPTIVE=args.adaptive,
+        SUBMIT_SCHEDULER=args.scheduler,
+        SUBMIT_ORDER=args.order,
+        # Nothing should expire during the run.
+        FLAG_LIFETIME=24 * 60 * 60,
+    ), version=0)
+
+    print(f'Seeding {args.flags} flags')
+    seed(args.flags, args.sploits, args.teams)
+
+    ticks = []
+    timings = {phase: [] for phase in PHASES}
+    submitted = 0
+    start = time.perf_counter()
+    for _ in range(args.max_ticks):
+        tick_start = time.perf_counter()
+        cycle = tasks.submit_cycle(snapshot)
+        ticks.append(time.perf_counter() - tick_start)
+        for phase, elapsed in cycle.timings.items():
+            timings[phase].append(elapsed)
+        submitted += cycle.submitted
+        if not cycle.queued:
+            break
+    elapsed = time.perf_counter() - start
+
+    with db_cursor(True) as (_, curs):
+        curs.execute('SELECT status, COUNT(*) AS cnt FROM all_flags GROUP BY status ORDER BY status')
+        statuses = {FlagStatus(row['status']).name: row['cnt'] for row in curs.fetchall()}
+    drained = sum(statuses.values()) - statuses.get(FlagStatus.QUEUED.name, 0)
+
+    print(f'{len(ticks)} ticks in {elapsed:.2f}s, {submitted} submissions, {drained / elapsed:.0f} flags/s drained')
+    print(f'Flags: {", ".join(f"{status}: {count}" for status, count in statuses.items())}')
+    print(f'Checksystem verdicts: {", ".join(f"{k.name}: {v}" for k, v in checksystem.verdicts.items())}')
+    print()
+
+    rows = []
+    for name, values in [*timings.items(), ('tick', ticks)]:
+        if values:
+            rows.append([
+                name,
+                f'{statistics.mean(values) * 1000:.1f}',
+                f'{percentile(values, 0.5) * 1000:.1f}',
+                f'{percentile(values, 0.99) * 1000:.1f}',
+            ])
+    print_table(['phase', 'mean, ms', 'p50, ms', 'p99, ms'], rows)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
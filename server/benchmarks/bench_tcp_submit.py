@@ -0,0 +1,70 @@
+"""
+Compares the pipelined TCP submitter with the old one-flag-at-a-time loop
+against the local checksystem emulator. Doesn't need a database.
+
+Usage: python bench_tcp_submit.py --flags 200 1000 --latency 0.001
+"""
+
+import argparse
+import socket
+import time
+
+from common import print_table, random_flag
+
+from emulator import Checksystem, Settings, start_server
+from models import Flag, FlagStatus
+from protocols import ructf_tcp, tcp
+
+
+def legacy_submit(flags, config):
+    sock = socket.create_connection((config['SYSTEM_HOST'], config['SYSTEM_PORT']), tcp.READ_TIMEOUT)
+    tcp.recvall(sock)
+    for item in flags:
+        sock.sendall(item.flag.encode() + b'\n')
+        tcp.recvall(sock).decode().strip()
+        yield item
+    sock.close()
+
+
+def measure(submit, flags, config):
+    start = time.perf_counter()
+    results = list(submit(flags, config))
+    assert len(results) == len(flags)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flags', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--latency', type=float, default=0.001, help='checksystem time per flag, seconds')
+    parser.add_argument('--window', type=int, default=tcp.DEFAULT_WINDOW)
+    args = parser.parse_args()
+
+    server = start_server('ructf_tcp', Checksystem(Settings(latency=args.latency, accept=1.0)))
+    config = {
+        'SYSTEM_HOST': '127.0.0.1',
+        'SYSTEM_PORT': server.server_address[1],
+        'SUBMIT_WINDOW': args.window,
+    }
+
+    # Open the persistent connection beforehand, as it is in the steady state.
+    list(ructf_tcp.submit_flags([], config))
+
+    rows = []
+    for count in args.flags:
+        flags = [Flag(random_flag(), 'sploit', 'team', 0, FlagStatus.QUEUED, None) for _ in range(count)]
+        legacy = measure(legacy_submit, flags, config)
+        pipelined = measure(ructf_tcp.submit_flags, flags, config)
+        rows.append([
+            count,
+            f'{count / legacy:.0f}',
+            f'{count / pipelined:.0f}',
+            f'{legacy / pipelined:.1f}x',
+        ])
+
+    server.shutdown()
+    print_table(['flags', 'one by one, flags/s', 'pipelined, flags/s', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
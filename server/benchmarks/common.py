@@ -0,0 +1,61 @@
+"""
+Shared helpers for the benchmarks. They talk to the database from POSTGRES_DSN
+and freely truncate it, so never point them at a farm that is in use.
+"""
+
+import random
+import string
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().absolute().parent.parent
+APP_DIR = SERVER_DIR / 'app'
+sys.path.insert(0, str(APP_DIR))
+# For the checksystem emulator.
+sys.path.insert(0, str(SERVER_DIR))
+
+from database import db_cursor  # noqa: E402
+
+FLAG_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def random_flag() -> str:
+    return ''.join(random.choices(FLAG_ALPHABET, k=31)) + '='
+
+
+def make_flags(count: int, sploits: int = 10, teams: int = 10) -> list[dict]:
+    return [
+        {
+            'flag': random_flag(),
+            'sploit': f'sploit_{random.randrange(sploits)}',
+            'team': f'Team #{random.randrange(teams)}',
+        }
+        for _ in range(count)
+    ]
+
+
+def reset_flags():
+    # The sploits and teams dictionaries are kept, their ids are cached by the process.
+    with db_cursor() as (conn, curs):
+        curs.execute('TRUNCATE flags, flags_queue, flags_seen, flag_stats, scheduler_deficits')
+        conn.commit()
+
+
+@contextmanager
+def timer(results: list):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        results.append(time.perf_counter() - start)
+
+
+def print_table(header: list[str], rows: list[list]):
+    widths = [
+        max(len(str(item)) for item in column)
+        for column in zip(header, *rows)
+    ]
+    for row in [header, *rows]:
+        print('  '.join(str(item).rjust(width) for item, width in zip(row, widths)))
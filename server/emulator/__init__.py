@@ -0,0 +1,10 @@
+"""
+Local checksystem emulator speaking the dialects of the farm's submit protocols,
+for benchmarks and manual testing. Run it with `python -m emulator --help`
+from the server directory.
+"""
+
+from emulator.checksystem import Checksystem, Settings, Verdict
+from emulator.servers import DIALECTS, start_server
+
+__all__ = ('Checksystem', 'Settings', 'Verdict', 'DIALECTS', 'start_server')
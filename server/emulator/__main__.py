@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from emulator import DIALECTS, Checksystem, Settings, start_server
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m emulator', description='Local checksystem emulator')
+    parser.add_argument('dialect', choices=DIALECTS)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=31337)
+    parser.add_argument('--latency', type=float, default=0.0, help='time per flag, seconds')
+    parser.add_argument('--accept', type=float, default=0.8, help='share of accepted new flags')
+    parser.add_argument('--reject', type=float, default=0.15,
+                        help='share of rejected new flags, the rest are to be resent')
+    parser.add_argument('--rate', type=int, help='flags per --period, unlimited by default')
+    parser.add_argument('--period', type=float, default=1.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    checksystem = Checksystem(
+        Settings(latency=args.latency, accept=args.accept, reject=args.reject, rate=args.rate, period=args.period),
+        seed=args.seed,
+    )
+    server = start_server(args.dialect, checksystem, args.host, args.port)
+    print('Serving {} checksystem on {}:{}'.format(args.dialect, *server.server_address))
+
+    try:
+        while True:
+            time.sleep(10)
+            print(', '.join(f'{verdict.name}: {count}' for verdict, count in sorted(
+                checksystem.verdicts.items(), key=lambda item: item[0].value)))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
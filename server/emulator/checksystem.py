@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+
+class Verdict(Enum):
+    ACCEPTED = 0
+    DUPLICATE = 1
+    REJECTED = 2
+    # The flag should be resent later, e.g. "no such flag" or "service is down".
+    RETRY = 3
+    RATE_LIMITED = 4
+
+
+@dataclass
+class Settings:
+    # Time the checksystem spends on each flag, seconds.
+    latency: float = 0.0
+    # Probabilities of the verdicts for new flags, the rest are RETRY.
+    accept: float = 0.8
+    reject: float = 0.15
+    # Token bucket: at most `rate` flags per `period` seconds, no limit if rate is None.
+    rate: Optional[int] = None
+    period: float = 1.0
+    # Flag lifetime reported by the HTTP APIs that have flag info.
+    flag_lifetime: int = 5 * 60
+
+
+class Checksystem:
+    def __init__(self, settings: Settings, seed: Optional[int] = None):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.accepted: set[str] = set()
+        self.verdicts: Counter = Counter()
+
+        self.tokens = float(settings.rate or 0)
+        self.refilled_at = time.monotonic()
+
+    def _take_token(self) -> bool:
+        if self.settings.rate is None:
+            return True
+
+        now = time.monotonic()
+        rate_per_second = self.settings.rate / self.settings.period
+        self.tokens = min(self.settings.rate, self.tokens + (now - self.refilled_at) * rate_per_second)
+        self.refilled_at = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def check(self, flag: str) -> Verdict:
+        if self.settings.latency:
+            time.sleep(self.settings.latency)
+
+        with self.lock:
+            if not self._take_token():
+                verdict = Verdict.RATE_LIMITED
+            elif flag in self.accepted:
+                verdict = Verdict.DUPLICATE
+            else:
+                roll = self.random.random()
+                if roll < self.settings.accept:
+                    verdict = Verdict.ACCEPTED
+                    self.accepted.add(flag)
+                elif roll < self.settings.accept + self.settings.reject:
+                    verdict = Verdict.REJECTED
+                else:
+                    verdict = Verdict.RETRY
+
+            self.verdicts[verdict] += 1
+        return verdict
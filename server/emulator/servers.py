@@ -0,0 +1,173 @@
+import datetime
+import json
+import socketserver
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from emulator.checksystem import Checksystem, Verdict
+
+
+@dataclass(frozen=True)
+class LineDialect:
+    greeting: bytes
+    # Response line template with {flag} and {message} placeholders.
+    template: str
+    messages: dict
+
+
+RUCTF_MESSAGES = {
+    Verdict.ACCEPTED: 'Accepted. 1.0 flag points',
+    Verdict.DUPLICATE: 'Denied: you already submitted this flag',
+    Verdict.REJECTED: 'Denied: flag is too old',
+    Verdict.RETRY: 'Denied: no such flag',
+    Verdict.RATE_LIMITED: 'Denied: try again later',
+}
+
+LINE_DIALECTS = {
+    'ructf_tcp': LineDialect(
+        greeting=b'Welcome! Enter your flags, finished with newline (or empty line to exit)\n',
+        template='[{flag}] {message}',
+        messages=RUCTF_MESSAGES,
+    ),
+    'ctfcup_tcp': LineDialect(
+        greeting=b'Please enter flags, one per line\n',
+        template='[{flag}] {message}',
+        messages={
+            Verdict.ACCEPTED: 'Accepted',
+            Verdict.DUPLICATE: 'already_submitted',
+            Verdict.REJECTED: 'too_old',
+            Verdict.RETRY: 'no such flag',
+            Verdict.RATE_LIMITED: 'try again later',
+        },
+    ),
+    'faust': LineDialect(
+        greeting=b'FAUST CTF Submission Service\nOne flag per line please!\n\n',
+        template='{flag} {message}',
+        messages={
+            Verdict.ACCEPTED: 'OK',
+            Verdict.DUPLICATE: 'DUP',
+            Verdict.REJECTED: 'OLD',
+            Verdict.RETRY: 'ERR',
+            Verdict.RATE_LIMITED: 'ERR Rate limit exceeded, try again later',
+        },
+    ),
+}
+
+VOLGACTF_CODES = {
+    Verdict.ACCEPTED: 'SUCCESS',
+    Verdict.DUPLICATE: 'ERROR_FLAG_SUBMITTED',
+    Verdict.REJECTED: 'ERROR_FLAG_EXPIRED',
+    Verdict.RETRY: 'ERROR_SERVICE_STATE_INVALID',
+    Verdict.RATE_LIMITED: 'ERROR_RATELIMIT',
+}
+
+
+class LineServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, checksystem: Checksystem, dialect: LineDialect):
+        self.checksystem = checksystem
+        self.dialect = dialect
+        super().__init__(address, LineHandler)
+
+
+class LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        dialect = self.server.dialect
+        self.wfile.write(dialect.greeting)
+        for line in self.rfile:
+            flag = line.strip().decode(errors='replace')
+            if not flag:
+                continue
+
+            verdict = self.server.checksystem.check(flag)
+            response = dialect.template.format(flag=flag, message=dialect.messages[verdict])
+            self.wfile.write(response.encode() + b'\n')
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, checksystem: Checksystem, handler):
+        self.checksystem = checksystem
+        super().__init__(address, handler)
+
+
+class BaseHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as the farm reuses its connections.
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def reply(self, code: int, body: bytes, content_type: str = 'text/plain'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RuCTFHandler(BaseHandler):
+    def do_PUT(self):
+        try:
+            flags = json.loads(self.read_body())
+        except ValueError:
+            return self.reply(400, b'Invalid JSON')
+
+        response = []
+        for flag in flags:
+            verdict = self.server.checksystem.check(flag)
+            response.append({
+                'flag': flag,
+                'msg': f'[{flag}] {RUCTF_MESSAGES[verdict]}',
+                'status': verdict == Verdict.ACCEPTED,
+            })
+        self.reply(200, json.dumps(response).encode(), 'application/json')
+
+
+class VolgaCTFHandler(BaseHandler):
+    INFO_PREFIX = '/api/flag/v1/info/'
+    SUBMIT_PATH = '/api/flag/v1/submit'
+
+    def do_GET(self):
+        if not self.path.startswith(self.INFO_PREFIX):
+            return self.reply(404, b'ERROR_NOT_FOUND')
+
+        expires = (datetime.datetime.now(datetime.timezone.utc) +
+                   datetime.timedelta(seconds=self.server.checksystem.settings.flag_lifetime))
+        self.reply(200, json.dumps({'exp': expires.isoformat()}).encode(), 'application/json')
+
+    def do_POST(self):
+        if self.path != self.SUBMIT_PATH:
+            return self.reply(404, b'ERROR_UNKNOWN')
+
+        verdict = self.server.checksystem.check(self.read_body().decode(errors='replace').strip())
+        code = VOLGACTF_CODES[verdict]
+        self.reply(200 if verdict == Verdict.ACCEPTED else 400, code.encode())
+
+
+HTTP_DIALECTS = {
+    'ructf_http': RuCTFHandler,
+    'volgactf': VolgaCTFHandler,
+}
+
+DIALECTS = sorted(LINE_DIALECTS.keys() | HTTP_DIALECTS.keys())
+
+
+def start_server(dialect: str, checksystem: Checksystem, host: str = '127.0.0.1', port: int = 0):
+    """Starts the checksystem in a daemon thread, the actual address is in server.server_address."""
+    if dialect in LINE_DIALECTS:
+        server = LineServer((host, port), checksystem, LINE_DIALECTS[dialect])
+    elif dialect in HTTP_DIALECTS:
+        server = HTTPServer((host, port), checksystem, HTTP_DIALECTS[dialect])
+    else:
+        raise ValueError(f'Unknown dialect {dialect}, expected one of {", ".join(DIALECTS)}')
+
+    threading.Thread(target=server.serve_forever, name=f'emulator-{dialect}', daemon=True).start()
+    return server